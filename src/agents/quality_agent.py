@@ -1,15 +1,61 @@
 import logging
-import json
-from lyzr_automata import Agent, Task
-from lyzr_automata.pipelines.linear_sync_pipeline import LinearSyncPipeline
-from src.custom_llm import CustomLiteLLM
+from lyzr_automata import Agent
+from src.custom_llm import get_litellm
 from src.models import ReviewComment
 from src.config import settings
-from src.prompts import QUALITY_PERSONA, QUALITY_INSTRUCTION_SUFFIX
-from src.utils import clean_json_output, validate_json_structure
+from src.prompts import QUALITY_PERSONA, QUALITY_INSTRUCTION_SUFFIX, QUALITY_PROMPT_VERSION
+from src.cache import result_cache, content_hash
+from src.utils import (
+    format_hunk_blocks, review_hunk_batch
+)
 
 logger = logging.getLogger(__name__)
 
+# Output allowance per reviewed hunk; a batched call gets this times its hunk count
+_OUTPUT_TOKENS_PER_HUNK = 2000
+
+# Static prompt text is assembled once at import; calls only fill in the hunk blocks.
+# Literal braces are doubled so str.format leaves them alone.
+_FORMAT_SAFE_SUFFIX = QUALITY_INSTRUCTION_SUFFIX.replace("{", "{{").replace("}", "}}")
+
+_BATCH_INSTRUCTION_TEMPLATE = (
+    """
+        Analyze the following DIFF HUNKS. Each hunk is tagged with its id, file and starting line.
+
+        """ + _FORMAT_SAFE_SUFFIX + """
+
+        IMPORTANT:
+        - Each hunk begins at its start_line in the actual file.
+        - If you detect an issue on a line inside a hunk, compute the REAL file line number as:
+            real_line = start_line + (line_number_inside_hunk)
+
+        Return STRICT JSON ONLY.
+
+        CODE HUNKS:
+        {hunk_blocks}
+
+        Return a JSON list with one object per hunk that has findings, using this schema:
+        [
+          {{
+            "hunk_id": "<id>",
+            "comments": [
+              {{
+                "file": "<file of that hunk>",
+                "line": <real_line>,
+                "type": "Quality",
+                "severity": "Critical"|"High"|"Medium"|"Low",
+                "message": "<Issue Description>",
+                "suggestion": "<Refactoring Advice>"
+              }}
+            ]
+          }}
+        ]
+
+        If every hunk is logically sound, return strictly [].
+        Do not include markdown formatting like ```json ... ```.
+        """
+)
+
 
 class QualityAgent:
     def __init__(self):
@@ -20,103 +66,75 @@ class QualityAgent:
         - None (reads settings.GOOGLE_API_KEY and QUALITY_MODEL_NAME)
 
         Output (sample):
-        - QualityAgent instance with llm_model and Agent(role="Senior Developer").
+        - QualityAgent instance with llm_model, Agent(role="Senior Developer") and result cache.
         """
-        self.llm_model = CustomLiteLLM(
-            api_key=settings.GOOGLE_API_KEY,
-            parameters={
-                "model": settings.QUALITY_MODEL_NAME,
-                "temperature": 0.2,
-                "max_tokens": 2000,
-            },
-        )
+        self.llm_model = get_litellm(settings.QUALITY_MODEL_NAME, 0.2, _OUTPUT_TOKENS_PER_HUNK)
 
         self.agent = Agent(
             role="Senior Developer",
             prompt_persona=QUALITY_PERSONA
         )
 
-    def analyze(self, content: str, filename: str, start_line: int) -> list[ReviewComment]:
+        # Parsed batch findings per hunk, keyed by content_hash(model, prompt version, hunk)
+        self._cache = result_cache("quality")
+
+    async def aanalyze_batch(self, hunks: list[dict]) -> dict[str, list[ReviewComment]]:
         """
-        Analyze one diff hunk for logic/reliability issues and return findings.
+        Analyze several diff hunks in one async model call and return findings keyed by hunk id.
 
         Input (sample):
-        - content: "+ result = total / count"
-        - filename: "src/service.py"
-        - start_line: 80
+        - hunks: [{"filename": "src/service.py", "content": "...", "start_line": 80}, ...]
 
         Output (sample):
-        - [ReviewComment(file="src/service.py", line=81, type="Quality", severity="High", message="Possible division by zero", suggestion="Guard count == 0")]
-        - [] when no issues or invalid LLM output
+        - {"0": [ReviewComment(file="src/service.py", line=81, type="Quality", ...)], "1": []}
+        - Only cached hunks on parse/runtime failure
         """
-        logger.info(f"Quality check on: {filename}")
-
-        # 1. Prepare instruction
-        instruction = f"""
-        Analyze the following DIFF HUNK from '{filename}'.
+        return await review_hunk_batch(
+            hunks, self._cache, self._cache_key, self._build_batch_instruction, self._arun_batch_prompt, "Quality Agent"
+        )
 
-        {QUALITY_INSTRUCTION_SUFFIX}
-    
-        IMPORTANT:
-        - This hunk begins at line {start_line} in the actual file.
-        - If you detect an issue on a line inside this hunk, compute the REAL file line number as:
-            real_line = {start_line} + (line_number_inside_hunk)
+    def _cache_key(self, content: str, filename: str, start_line: int) -> str:
+        """
+        Derive the result-cache key for one hunk.
 
-        - For example:
-            If issue is in "+5" inside hunk → real_line = {start_line} + 5
+        Input (sample):
+        - content: "...", filename: "src/service.py", start_line: 80
 
-        Return STRICT JSON ONLY.
+        Output (sample):
+        - "3b1f..." (blake2b over model, prompt version, file, line and content)
+        """
+        return content_hash(
+            settings.QUALITY_MODEL_NAME, QUALITY_PROMPT_VERSION, filename, start_line, content
+        )
 
-        CODE HUNK:
-        {content}
-        
-        Return a JSON list of objects with this schema:
-        [
-          {{
-            "file": "{filename}",
-            "line": <real_line>,
-            "type": "Quality",
-            "severity": "Critical"|"High"|"Medium"|"Low",
-            "message": "<Issue Description>",
-            "suggestion": "<Refactoring Advice>"
-          }}
-        ]
-        
-        If the code is logically sound, return strictly [].
-        Do not include markdown formatting like ```json ... ```.
+    async def _arun_batch_prompt(self, instruction: str, hunk_count: int) -> str:
         """
+        Send one batched instruction to the model with the agent persona as system message.
+        The output limit grows with the hunk count so a finding-heavy batch is not cut off mid-JSON.
 
-        # 2. Create Task
-        task = Task(
-            name="Quality Review",
-            model=self.llm_model,
-            agent=self.agent,
-            instructions=instruction,
+        Input (sample):
+        - instruction: "Analyze the following DIFF HUNKS. ... ### HUNK id=0 file=src/service.py start_line=80 ..."
+        - hunk_count: 4
+
+        Output (sample):
+        - "[{\"hunk_id\": \"0\", \"comments\": [...]}]"
+        """
+        return await self.llm_model.agenerate_text(
+            task_id="Quality Review",
+            system_persona=self.agent.prompt_persona,
+            prompt=instruction,
+            max_tokens=_OUTPUT_TOKENS_PER_HUNK * hunk_count,
         )
 
-        try:
-            # 3. Run Pipeline
-            response = LinearSyncPipeline(
-                name="Quality Analysis Pipeline",
-                completion_message="Quality check complete",
-                tasks=[task],
-            ).run()
-            
-            # 4. Parse output
-            raw_output = response[0]['task_output'] if isinstance(response, list) else response
-            cleaned_output = clean_json_output(raw_output)
-            
-            if not validate_json_structure(cleaned_output):
-                logger.error(f"Invalid JSON structure from Quality Agent for {filename}")
-                return []
-            
-            json_data = json.loads(cleaned_output)
-            
-            return [ReviewComment(**item) for item in json_data]
-
-        except json.JSONDecodeError:
-            logger.error(f"Failed to parse JSON from Quality Agent for {filename}. Raw: {raw_output}")
-            return []
-        except Exception as e:
-            logger.error(f"Quality Agent failed on {filename}: {e}")
-            return []
+    def _build_batch_instruction(self, hunks: list[dict]) -> str:
+        """
+        Build one quality review prompt covering several hunks tagged by id.
+
+        Input (sample):
+        - hunks: [{"filename": "src/service.py", "content": "...", "start_line": 80}]
+
+        Output (sample):
+        - "Analyze the following DIFF HUNKS. ... ### HUNK id=0 file=src/service.py start_line=80 ..."
+        """
+        return _BATCH_INSTRUCTION_TEMPLATE.format(hunk_blocks=format_hunk_blocks(hunks))
+
@@ -1,15 +1,61 @@
 import logging
-import json
-from lyzr_automata import Agent, Task
-from lyzr_automata.pipelines.linear_sync_pipeline import LinearSyncPipeline
-from src.custom_llm import CustomLiteLLM
+from lyzr_automata import Agent
+from src.custom_llm import get_litellm
 from src.models import ReviewComment
 from src.config import settings
-from src.prompts import SECURITY_PERSONA, SECURITY_INSTRUCTION_SUFFIX
-from src.utils import clean_json_output, validate_json_structure
+from src.prompts import SECURITY_PERSONA, SECURITY_INSTRUCTION_SUFFIX, SECURITY_PROMPT_VERSION
+from src.cache import result_cache, content_hash
+from src.utils import (
+    format_hunk_blocks, review_hunk_batch
+)
 
 logger = logging.getLogger(__name__)
 
+# Output allowance per reviewed hunk; a batched call gets this times its hunk count
+_OUTPUT_TOKENS_PER_HUNK = 2000
+
+# Static prompt text is assembled once at import; calls only fill in the hunk blocks.
+# Literal braces are doubled so str.format leaves them alone.
+_FORMAT_SAFE_SUFFIX = SECURITY_INSTRUCTION_SUFFIX.replace("{", "{{").replace("}", "}}")
+
+_BATCH_INSTRUCTION_TEMPLATE = (
+    """
+        Analyze the following DIFF HUNKS. Each hunk is tagged with its id, file and starting line.
+
+        """ + _FORMAT_SAFE_SUFFIX + """
+
+        IMPORTANT:
+        - Each hunk begins at its start_line in the actual file.
+        - If you detect an issue on a line inside a hunk, compute the REAL file line number as:
+            real_line = start_line + (line_number_inside_hunk)
+
+        Return STRICT JSON ONLY.
+
+        CODE HUNKS:
+        {hunk_blocks}
+
+        Return a JSON list with one object per hunk that has findings, using this schema:
+        [
+          {{
+            "hunk_id": "<id>",
+            "comments": [
+              {{
+                "file": "<file of that hunk>",
+                "line": <real_line>,
+                "type": "Security",
+                "severity": "Critical"|"High"|"Medium"|"Low",
+                "message": "<Issue Description>",
+                "suggestion": "<Refactoring Advice>"
+              }}
+            ]
+          }}
+        ]
+
+        CRITICAL: If every hunk is safe or contains no obvious vulnerabilities, return strictly [].
+        Do not hallucinate issues. Do not include markdown formatting like ```json ... ```.
+        """
+)
+
 
 class SecurityAgent:
     def __init__(self):
@@ -20,103 +66,76 @@ class SecurityAgent:
         - None (reads settings.GOOGLE_API_KEY and SECURITY_MODEL_NAME)
 
         Output (sample):
-        - SecurityAgent instance with configured llm_model and Agent(role="Security Auditor").
+        - SecurityAgent instance with configured llm_model, Agent(role="Security Auditor") and result cache.
         """
-        self.llm_model = CustomLiteLLM(
-            api_key=settings.GOOGLE_API_KEY,
-            parameters={
-                "model": settings.SECURITY_MODEL_NAME,
-                "temperature": 0.1,
-                "max_tokens": 2000,
-            },
-        )
+        self.llm_model = get_litellm(settings.SECURITY_MODEL_NAME, 0.1, _OUTPUT_TOKENS_PER_HUNK)
 
         self.agent = Agent(
             role="Security Auditor",
             prompt_persona=SECURITY_PERSONA
         )
 
-    def analyze(self, content: str, filename: str, start_line: int) -> list[ReviewComment]:
+        # Parsed findings per hunk, keyed by content_hash(model, prompt version, hunk)
+        self._cache = result_cache("security")
+
+    async def aanalyze_batch(self, hunks: list[dict]) -> dict[str, list[ReviewComment]]:
         """
-        Analyze one diff hunk for security vulnerabilities and return typed findings.
+        Analyze several diff hunks in one async model call and return findings keyed by hunk id.
 
         Input (sample):
-        - content: "+ query = f\"SELECT * FROM users WHERE id={uid}\""
-        - filename: "src/db.py"
-        - start_line: 120
+        - hunks: [{"filename": "src/db.py", "content": "+ query = ...", "start_line": 120}, ...]
 
         Output (sample):
-        - [ReviewComment(file="src/db.py", line=125, type="Security", severity="High", message="...", suggestion="...")]
-        - [] when no issues or parse/runtime failure
+        - {"0": [ReviewComment(file="src/db.py", line=125, type="Security", ...)], "1": []}
+        - Only cached hunks on parse/runtime failure
+        """
+        return await review_hunk_batch(
+            hunks, self._cache, self._cache_key, self._build_batch_instruction, self._arun_batch_prompt, "Security Agent"
+        )
+
+    def _cache_key(self, content: str, filename: str, start_line: int) -> str:
         """
-        logger.info(f"Security scan on: {filename}")
+        Derive the result-cache key for one hunk.
 
-        # 1. Prepare instruction
-        instruction = f"""
-        Analyze the following DIFF HUNK from '{filename}'.
+        Input (sample):
+        - content: "+ query = ...", filename: "src/db.py", start_line: 120
 
-        {SECURITY_INSTRUCTION_SUFFIX}
+        Output (sample):
+        - "3b1f..." (blake2b over model, prompt version, file, line and content)
+        """
+        return content_hash(
+            settings.SECURITY_MODEL_NAME, SECURITY_PROMPT_VERSION, filename, start_line, content
+        )
 
-        IMPORTANT:
-        - This hunk begins at line {start_line} in the actual file.
-        - If you detect an issue on a line inside this hunk, compute the REAL file line number as:
-            real_line = {start_line} + (line_number_inside_hunk)
+    async def _arun_batch_prompt(self, instruction: str, hunk_count: int) -> str:
+        """
+        Send one instruction straight to the model with the agent persona as system message.
+        The answer is streamed so a safe "[]" verdict returns without waiting for the full generation,
+        and its output limit grows with the hunk count so a finding-heavy batch is not cut off mid-JSON.
 
-        - For example:
-            If issue is in "+5" inside hunk → real_line = {start_line} + 5
+        Input (sample):
+        - instruction: "Analyze the following DIFF HUNKS. ... ### HUNK id=0 file=src/db.py start_line=120 ..."
+        - hunk_count: 4
 
-        Return STRICT JSON ONLY.
+        Output (sample):
+        - "[{\"hunk_id\": \"0\", \"comments\": [...]}]"
+        """
+        return await self.llm_model.agenerate_text(
+            task_id="Security Audit",
+            system_persona=self.agent.prompt_persona,
+            prompt=instruction,
+            stop_on_empty_list=True,
+            max_tokens=_OUTPUT_TOKENS_PER_HUNK * hunk_count,
+        )
 
-        CODE HUNK:
-        {content}
-        
-        Return a JSON list of objects with this schema:
-        [
-          {{
-            "file": "{filename}",
-            "line": <real_line>,
-            "type": "Security",
-            "severity": "Critical"|"High"|"Medium"|"Low",
-            "message": "<Issue Description>",
-            "suggestion": "<Refactoring Advice>"
-          }}
-        ]
-        
-        CRITICAL: If the code is safe or contains no obvious vulnerabilities, return strictly [].
-        Do not hallucinate issues. Do not include markdown formatting like ```json ... ```.
+    def _build_batch_instruction(self, hunks: list[dict]) -> str:
         """
+        Build one security-audit prompt covering several hunks tagged by id.
 
-        # 2. Create Task
-        task = Task(
-            name="Security Audit",
-            model=self.llm_model,
-            agent=self.agent,
-            instructions=instruction,
-        )
+        Input (sample):
+        - hunks: [{"filename": "src/db.py", "content": "+ query = ...", "start_line": 120}]
 
-        try:
-            # 3. Run Pipeline
-            response = LinearSyncPipeline(
-                name="Security Analysis Pipeline",
-                completion_message="Security scan complete",
-                tasks=[task],
-            ).run()
-            
-            # 4. Parse output
-            raw_output = response[0]['task_output'] if isinstance(response, list) else response
-            cleaned_output = clean_json_output(raw_output)
-            
-            if not validate_json_structure(cleaned_output):
-                logger.error(f"Invalid JSON structure from Security Agent for {filename}")
-                return []
-            
-            json_data = json.loads(cleaned_output)
-            
-            return [ReviewComment(**item) for item in json_data]
-
-        except json.JSONDecodeError:
-            logger.error(f"Failed to parse JSON from Security Agent for {filename}. Raw: {raw_output}")
-            return []
-        except Exception as e:
-            logger.error(f"Security Agent failed on {filename}: {e}")
-            return []
+        Output (sample):
+        - "Analyze the following DIFF HUNKS. ... ### HUNK id=0 file=src/db.py start_line=120 ..."
+        """
+        return _BATCH_INSTRUCTION_TEMPLATE.format(hunk_blocks=format_hunk_blocks(hunks))
@@ -1,15 +1,84 @@
+import asyncio
 import logging
 import re
-from typing import List, Dict
+from operator import itemgetter
+from typing import List, Dict, Set
 from src.models import ReviewComment
 from src.config import settings
-from lyzr_automata import Agent, Task
-from lyzr_automata.pipelines.linear_sync_pipeline import LinearSyncPipeline
-from src.custom_llm import CustomLiteLLM
+from lyzr_automata import Agent
+from src.custom_llm import get_litellm
 from src.utils import is_test_file
+from src.cache import LRUCache, content_hash
 
 logger = logging.getLogger(__name__)
 
+_TYPE_ICONS = {"Security": "🛡️", "Quality": "🧠", "Architect": "🏗️"}
+_SEV_ICONS = {"Critical": "🔴", "High": "🟠", "Medium": "🟡", "Low": "🔵"}
+# Sort rank per severity; unknown severities sort last
+_SEVERITY_RANK = {"Critical": 0, "High": 1, "Medium": 2, "Low": 3}
+# Severities listed in the findings table
+_TABLE_SEVERITIES = frozenset({"Critical", "High"})
+# Agent types barred from reporting security topics
+_NON_SECURITY_TYPES = frozenset({"Quality", "Architect"})
+# Output caps; GitHub truncates very large comments anyway
+MAX_TABLE_ROWS = 200
+MAX_DETAILS_PER_FILE = 200
+
+# Message normalisation and summary trimming patterns
+_PUNCT_RE = re.compile(r"[^a-z0-9 ]")
+_WS_RE = re.compile(r"\s+")
+_SENT_RE = re.compile(r"[.!?]")
+# Length of the normalised-message prefix that groups similar findings
+_GROUP_KEY_CHARS = 80
+
+# Keywords that belong ONLY to Security Agent
+_SECURITY_KEYWORDS = frozenset({
+    "sql injection", "xss", "csrf", "secret", "password", "api key", "credential",
+    "timing attack", "vulnerability", "unsafe", "unsanitized", "sanitize",
+    "parameterized", "raw query",
+    # Expanded set for broader coverage
+    "injection", "inject", "escape", "escaping", "unescaped",
+    "eval", "deserialize", "deserialization",
+    "tainted", "taint", "malicious", "attack", "exploit"
+})
+
+# False-positive phrases that should not trigger firewall
+_FALSE_OK = frozenset({
+    "not vulnerable", "already sanitized", "no injection", "not an injection",
+    "no vulnerability", "not exploitable", "sanitized input"
+})
+
+
+def _keyword_re(keywords) -> re.Pattern:
+    """
+    Compile keywords into one alternation that matches any of them as a substring.
+
+    Input (sample):
+    - keywords: {"xss", "sql injection"}
+
+    Output (sample):
+    - re.compile("sql\\ injection|xss")
+    """
+    return re.compile("|".join(map(re.escape, sorted(keywords, key=len, reverse=True))))
+
+
+_SECURITY_RE = _keyword_re(_SECURITY_KEYWORDS)
+_FALSE_OK_RE = _keyword_re(_FALSE_OK)
+
+
+def _normalize_message(message: str) -> str:
+    """
+    Lowercase a finding message and reduce it to space-separated alphanumeric words.
+
+    Input (sample):
+    - message: "Possible SQL-injection in `query()`!"
+
+    Output (sample):
+    - "possible sql injection in query"
+    """
+    return _WS_RE.sub(" ", _PUNCT_RE.sub(" ", (message or "").lower())).strip()
+
+
 class SynthesizerAgent:
     def __init__(self):
         """
@@ -19,22 +88,18 @@ class SynthesizerAgent:
         - None (reads settings.GOOGLE_API_KEY and SYNTHESIZER_MODEL_NAME)
 
         Output (sample):
-        - SynthesizerAgent instance with llm_model and summary Agent.
+        - SynthesizerAgent instance with llm_model, summary Agent and summary cache.
         """
-        self.llm_model = CustomLiteLLM(
-            api_key=settings.GOOGLE_API_KEY,
-            parameters={
-                "model": settings.SYNTHESIZER_MODEL_NAME,
-                "temperature": 0.2,
-                "max_tokens": 200, 
-            },
-        )
+        self.llm_model = get_litellm(settings.SYNTHESIZER_MODEL_NAME, 0.2, 60)
         self.agent = Agent(
             role="Technical Writer",
             prompt_persona="You are a concise Technical Writer."
         )
 
-    def create_report(self, comments: List[ReviewComment]) -> str:
+        # One-sentence summaries keyed by content_hash(model, top findings)
+        self._summary_cache = LRUCache(maxsize=settings.LLM_CACHE_SIZE)
+
+    async def acreate_report(self, comments: List[ReviewComment]) -> str:
         """
         Convert raw review comments into a deduplicated, policy-filtered markdown report.
 
@@ -47,141 +112,129 @@ class SynthesizerAgent:
         if not comments:
             return "## ✅ Lyzr Review: No Issues Found\n\nYour code looks clean!"
 
+        # 1. Pre-processing pipeline, fused into one pass over the raw comments
+        domain_safe_comments = []
+        norm_cache = {}
         for c in comments:
             try:
                 c.line = int(c.line)
             except Exception:
                 c.line = 0
 
-        # 1. Pre-processing pipeline
-        # Step A: Filter test files
-        filtered_comments = []
-        for c in comments:
+            # Step A: Test-file policy
             if is_test_file(c.file):
                 if c.type == "Security":
                     continue
                 c.severity = "Low"
-            filtered_comments.append(c)
 
-        # Step B: Domain firewall
-        domain_safe_comments = self._enforce_domain_boundaries(filtered_comments)
+            # Normalise each message once; the firewall and grouping both key off it
+            clean_msg = _normalize_message(c.message)
+
+            # Step B: Domain firewall
+            if not self._within_domain(c, clean_msg):
+                continue
+
+            norm_cache[id(c)] = clean_msg
+            domain_safe_comments.append(c)
+
+        # Step C: One severity sort (after test-file downgrades) feeds dedup, grouping and the summary
+        domain_safe_comments.sort(key=lambda x: _SEVERITY_RANK.get(x.severity, 4))
 
-        # Step C: Deduplication
+        # Step D: Deduplication
         unique_comments = self._advanced_deduplicate(domain_safe_comments)
 
-        # 2. Grouping & sorting
-        grouped_issues = self._group_comments(unique_comments)
-        
-        severity_order = {"Critical": 0, "High": 1, "Medium": 2, "Low": 3}
-        grouped_issues.sort(key=lambda x: severity_order.get(x['severity'], 4))
+        # 2. Start the summary LLM call; the markdown below doesn't depend on it
+        summary_task = asyncio.create_task(self._agenerate_summary_header(unique_comments))
+        # Yield once so the task sends its request before the CPU-bound formatting starts
+        await asyncio.sleep(0)
 
-        # 3. Generate summary
-        summary_header = self._generate_summary_header(unique_comments)
-        
-        report_body = "### 📊 Findings Summary\n\n"
+        # 3. Grouping; groups are created in first-occurrence order, so they are already severity-sorted
+        grouped_issues = self._group_comments(unique_comments, norm_cache)
+
+        parts: List[str] = ["### 📊 Findings Summary\n\n"]
         
-        high_sev_groups = [g for g in grouped_issues if g['severity'] in ["Critical", "High"]]
+        high_sev_groups = [g for g in grouped_issues if g['severity'] in _TABLE_SEVERITIES]
         
         if high_sev_groups:
-            report_body += "| Severity | Type | File | Lines | Issue |\n"
-            report_body += "| :--- | :--- | :--- | :--- | :--- |\n"
+            parts.append("| Severity | Type | File | Lines | Issue |\n")
+            parts.append("| :--- | :--- | :--- | :--- | :--- |\n")
             
-            for g in high_sev_groups:
-                icon = self._get_icon(g['type'])
-                sev_icon = self._get_severity_icon(g['severity'])
+            for g in high_sev_groups[:MAX_TABLE_ROWS]:
+                icon = _TYPE_ICONS.get(g['type'], "📝")
+                sev_icon = _SEV_ICONS.get(g['severity'], "⚪")
                 
                 raw_msg = g['message'].split('\n')[0].replace("|", "-")
                 short_msg = (raw_msg[:75] + '...') if len(raw_msg) > 75 else raw_msg
                 
                 lines_str = self._format_lines(g['lines'])
                 
-                report_body += f"| {sev_icon} **{g['severity']}** | {icon} {g['type']} | `{g['file']}` | {lines_str} | {short_msg} |\n"
+                parts.append(f"| {sev_icon} **{g['severity']}** | {icon} {g['type']} | `{g['file']}` | {lines_str} | {short_msg} |\n")
+
+            if len(high_sev_groups) > MAX_TABLE_ROWS:
+                parts.append(f"\n_... {len(high_sev_groups) - MAX_TABLE_ROWS} more Critical/High findings not shown in this table ..._\n")
         else:
-            report_body += "*No Critical or High severity issues found. See details below.*\n"
+            parts.append("*No Critical or High severity issues found. See details below.*\n")
 
-        report_body += "\n"
+        parts.append("\n")
 
 
-        report_body += "<details>\n<summary><b>🔍 View Detailed Analysis & Code Fixes</b></summary>\n\n"
+        parts.append("<details>\n<summary><b>🔍 View Detailed Analysis & Code Fixes</b></summary>\n\n")
         
-        files_dict = {}
+        # grouped_issues is severity-sorted; first-seen order puts the file with the worst finding first
+        by_file: Dict[str, List[Dict]] = {}
         for g in grouped_issues:
-            if g['file'] not in files_dict: files_dict[g['file']] = []
-            files_dict[g['file']].append(g)
-
-        for filename, groups in files_dict.items():
-            report_body += f"#### 📄 `{filename}`\n"
-            for g in groups:
-                icon = self._get_icon(g['type'])
-                sev_icon = self._get_severity_icon(g['severity'])
+            by_file.setdefault(g['file'], []).append(g)
+
+        for filename, groups in by_file.items():
+            parts.append(f"#### 📄 `{filename}`\n")
+            for g in groups[:MAX_DETAILS_PER_FILE]:
+                sev_icon = _SEV_ICONS.get(g['severity'], "⚪")
                 
                 lines_display = self._format_lines(g['lines'])
                 line_prefix = "Line" if len(g['lines']) == 1 else "Lines"
                 
-                report_body += f"---\n"
-                report_body += f"**{sev_icon} {line_prefix} {lines_display}** [{g['type']}]\n\n"
-                report_body += f"**Issue:** {g['message']}\n\n"
+                parts.append("---\n")
+                parts.append(f"**{sev_icon} {line_prefix} {lines_display}** [{g['type']}]\n\n")
+                parts.append(f"**Issue:** {g['message']}\n\n")
                 
                 if g['suggestion']:
-                    report_body += f"**Suggested Fix:**\n```python\n{g['suggestion']}\n```\n"
-            report_body += "\n"
+                    parts.append(f"**Suggested Fix:**\n```python\n{g['suggestion']}\n```\n")
+
+            if len(groups) > MAX_DETAILS_PER_FILE:
+                parts.append(f"\n_... {len(groups) - MAX_DETAILS_PER_FILE} more findings suppressed ..._\n")
+            parts.append("\n")
 
-        report_body += "</details>"
+        parts.append("</details>")
 
-        return summary_header + "\n\n" + report_body
+        summary_header = await summary_task
+        return summary_header + "\n\n" + "".join(parts)
 
-    def _enforce_domain_boundaries(self, comments: List[ReviewComment]) -> List[ReviewComment]:
+    def _within_domain(self, c: ReviewComment, clean_msg: str) -> bool:
         """
-        Drop findings where agent scope is violated (for example non-security agents reporting security topics).
+        Check that a finding stays inside its agent's scope (for example non-security agents reporting security topics).
 
         Input (sample):
-        - comments: [ReviewComment(type="Quality", message="SQL injection risk", ...)]
+        - c: ReviewComment(type="Quality", message="SQL injection risk", ...)
+        - clean_msg: "sql injection risk"
 
         Output (sample):
-        - Filtered list excluding out-of-domain comments
+        - False (comment should be dropped)
         """
-        allowed = []
-        
-        # Keywords that belong ONLY to Security Agent
-        security_keywords = {
-            "sql injection", "xss", "csrf", "secret", "password", "api key", "credential", 
-            "timing attack", "vulnerability", "unsafe", "unsanitized", "sanitize", 
-            "parameterized", "raw query",
-            # Expanded set for broader coverage
-            "injection", "inject", "escape", "escaping", "unescaped",
-            "eval", "deserialize", "deserialization",
-            "tainted", "taint", "malicious", "attack", "exploit"
-        }
-
-        # False-positive phrases that should not trigger firewall
-        false_ok = {
-            "not vulnerable", "already sanitized", "no injection", "not an injection",
-            "no vulnerability", "not exploitable", "sanitized input"
-        }
-        
-        for c in comments:
-            # UPGRADE: Regex cleaner (Fix #1)
-            msg_lower = (c.message or "").lower()
-            # Remove punctuation to ensure keyword matching is robust
-            clean_msg = re.sub(r"[^a-z0-9 ]", " ", msg_lower)
-            clean_msg = re.sub(r"\s+", " ", clean_msg).strip()
-
-            if any(fk in clean_msg for fk in false_ok):
-                allowed.append(c)
-                continue
+        # clean_msg has punctuation stripped so keyword matching is robust
+        if _FALSE_OK_RE.search(clean_msg):
+            return True
 
-            # Rule 1: Quality/Architect cannot report security keywords
-            if c.type in ["Quality", "Architect"]:
-                if any(k in clean_msg for k in security_keywords):
-                    logger.info(f"🔥 Firewall dropped {c.type} comment on {c.file}:{c.line} due to security keyword.")
-                    continue
-                    
-            allowed.append(c)
-        return allowed
+        # Rule 1: Quality/Architect cannot report security keywords
+        if c.type in _NON_SECURITY_TYPES and _SECURITY_RE.search(clean_msg):
+            logger.info(f"🔥 Firewall dropped {c.type} comment on {c.file}:{c.line} due to security keyword.")
+            return False
+
+        return True
 
     def _advanced_deduplicate(self, comments: List[ReviewComment]) -> List[ReviewComment]:
         """
         Deduplicate findings by enforcing one winner per file line with severity priority and security dominance.
+        Expects comments already severity-sorted by acreate_report.
 
         Input (sample):
         - comments: [Security@a.py:10 High, Quality@a.py:10 Medium, Architect@a.py:12 Low]
@@ -189,97 +242,72 @@ class SynthesizerAgent:
         Output (sample):
         - [Security@a.py:10 High, Architect@a.py:12 Low]
         """
-        severity_weight = {"Critical": 0, "High": 1, "Medium": 2, "Low": 3}
-        comments.sort(key=lambda x: severity_weight.get(x.severity, 4))
+        winner = {}
 
-        final_list = []
-        security_claimed_lines = set()
-        all_claimed_lines = set()
+        # Single scan: highest severity claims the line, a Security finding overrides a non-Security one
+        for idx, c in enumerate(comments):
+            line_key = (c.file, c.line)
+            current = winner.get(line_key)
 
-        # Pass 1: Identify security claims
-        for c in comments:
-            if c.type == "Security":
-                try:
-                    ln = int(c.line)
-                except Exception:
-                    ln = 0
-                security_claimed_lines.add((c.file, ln))
-
-        # Pass 2: Filter and assign
-        for c in comments:
-            try:
-                ln = int(c.line)
-            except Exception:
-                ln = 0
-            line_key = (c.file, ln)
-
-            # Rule A: Security dominance
-            if c.type != "Security" and line_key in security_claimed_lines:
-                continue
-
-            if c.type == "Security" and line_key in all_claimed_lines:
-                continue
-
-            # Rule B: Highlander rule — one comment per line
-            if line_key in all_claimed_lines:
-                continue
-            
-            all_claimed_lines.add(line_key)
-            c.line = ln
-            final_list.append(c)
+            # Highlander rule — one comment per line
+            if current is None:
+                winner[line_key] = (idx, c)
+            # Security dominance
+            elif c.type == "Security" and current[1].type != "Security":
+                winner[line_key] = (idx, c)
 
-        return final_list
+        # Emit survivors in severity order (their position in the sorted list)
+        return [c for _, c in sorted(winner.values(), key=itemgetter(0))]
 
-    def _group_comments(self, comments: List[ReviewComment]) -> List[Dict]:
+    def _group_comments(self, comments: List[ReviewComment], norm_cache: Dict[int, str]) -> List[Dict]:
         """
         Group similar comments by file/type/severity and normalized message signature.
 
         Input (sample):
         - comments: [Comment(file="a.py", message="Use parameterized query", line=3), Comment(file="a.py", message="Use parameterized query now", line=8)]
+        - norm_cache: {id(comment): "use parameterized query", ...}
 
         Output (sample):
-        - [{"file": "a.py", "type": "Security", "severity": "High", "message": "...", "suggestion": "...", "lines": [3, 8]}]
+        - [{"file": "a.py", "type": "Security", "severity": "High", "message": "...", "suggestion": "...", "lines": {3, 8}}]
         """
         grouped = {}
         for c in comments:
-            normalized = re.sub(r"[^a-z0-9 ]", " ", (c.message or "").lower())
-            normalized = re.sub(r"\s+", " ", normalized).strip()
-            words = normalized.split()
-            msg_key = " ".join(words[:10])
-            key = (c.file, c.type, c.severity, msg_key)
-            
-            if key not in grouped:
-                grouped[key] = {
-                    'file': c.file,
-                    'type': c.type,
-                    'severity': c.severity,
-                    'message': c.message,
-                    'suggestion': c.suggestion,
-                    'lines': []
-                }
-            grouped[key]['lines'].append(c.line)
+            message = c.message or ""
+            msg_key = norm_cache[id(c)][:_GROUP_KEY_CHARS]
+            file, type_, severity = c.file, c.type, c.severity
+
+            group = grouped.setdefault((file, type_, severity, msg_key), {
+                'file': file,
+                'type': type_,
+                'severity': severity,
+                'message': message,
+                'suggestion': c.suggestion,
+                'lines': set()
+            })
+            group['lines'].add(c.line)
         return list(grouped.values())
 
-    def _format_lines(self, lines: List[int]) -> str:
+    def _format_lines(self, lines: Set[int]) -> str:
         """
         Format line numbers for report display using compact range rules.
 
         Input (sample):
-        - lines: [2, 3, 4, 10]
+        - lines: {2, 3, 4, 10}
 
         Output (sample):
         - "2..10" (for more than 3 unique lines)
         - "2, 3" (for short lists)
         """
-        lines = sorted(list(set(lines)))
         if not lines: return ""
+        # Only the endpoints are shown for long lists, so skip the sort
         if len(lines) > 3:
-            return f"{lines[0]}..{lines[-1]}"
-        return ", ".join(map(str, lines))
+            return f"{min(lines)}..{max(lines)}"
+        return ", ".join(map(str, sorted(lines)))
 
-    def _generate_summary_header(self, comments: List[ReviewComment]) -> str:
+    async def _agenerate_summary_header(self, comments: List[ReviewComment]) -> str:
         """
         Generate top markdown header with issue counts and one-sentence executive summary.
+        Expects comments in severity order (as returned by _advanced_deduplicate), so the first distinct ones are the top findings.
 
         Input (sample):
         - comments: [ReviewComment(severity="Critical", message="..."), ReviewComment(severity="Low", message="...")]
@@ -288,9 +316,31 @@ class SynthesizerAgent:
         - "## 🤖 Lyzr Review Report\n\n**Total Issues:** 2 | **Critical Issues:** 1\n\n> ..."
         """
         count = len(comments)
-        critical_count = len([c for c in comments if c.severity == 'Critical'])
-        top_issues = comments[:5]
-        issues_list = "\n".join([f"- [{c.type}] {c.message}" for c in top_issues])
+        critical_count = sum(1 for c in comments if c.severity == 'Critical')
+
+        high_count = sum(1 for c in comments if c.severity == 'High')
+
+        # Without Critical/High findings (or with only a handful) an LLM-written summary adds little
+        if critical_count == 0 and (count <= 3 or high_count == 0):
+            noun = "issue" if count == 1 else "issues"
+            if high_count:
+                noted = f"{count} {noun} noted, {high_count} of them High severity"
+            else:
+                noted = f"{count} minor {noun} noted"
+            return f"## 🤖 Lyzr Review Report\n\n**Total Issues:** {count} | **Critical Issues:** 0\n\n> {noted}; no critical findings.\n"
+
+        # Top five distinct findings; near-duplicates only add prompt tokens
+        top_issues = []
+        seen = set()
+        for c in comments:
+            key = (c.type, (c.message or "")[:40])
+            if key in seen:
+                continue
+            seen.add(key)
+            top_issues.append(c)
+            if len(top_issues) == 5:
+                break
+        issues_list = "\n".join(f"- [{c.type}] {c.message}" for c in top_issues)
         
         instruction = f"""
         You are a CTO summarizing a code review.
@@ -298,37 +348,38 @@ class SynthesizerAgent:
         {issues_list}
         Task: Write EXACTLY ONE sentence (max 20 words) summarizing the overall health.
         """
-        try:
-            task = Task(name="Summary", model=self.llm_model, agent=self.agent, instructions=instruction)
-            response = LinearSyncPipeline(name="Summary", completion_message="Done", tasks=[task]).run()
-            ai_summary = response[0]['task_output'] if isinstance(response, list) else response
-            ai_summary = (ai_summary or "").replace("\n", " ").strip()
-            ai_summary = re.split(r"[.!?]", ai_summary)[0][:120].strip()
-        except Exception:
-            ai_summary = "Review completed."
-
-        return f"## 🤖 Lyzr Review Report\n\n**Total Issues:** {count} | **Critical Issues:** {critical_count}\n\n> {ai_summary}\n"
-
-    def _get_icon(self, type_: str) -> str:
-        """
-        Map finding type to a display icon for markdown rendering.
+        cache_key = content_hash(
+            settings.SYNTHESIZER_MODEL_NAME, *sorted((c.type, c.message) for c in top_issues)
+        )
+        ai_summary = self._summary_cache.get(cache_key)
 
-        Input (sample):
-        - type_: "Security"
+        if ai_summary is None:
+            try:
+                ai_summary = await self._arun_single_prompt(instruction)
+                ai_summary = (ai_summary or "").replace("\n", " ").strip()
+                ai_summary = _SENT_RE.split(ai_summary)[0][:120].strip()
+                if ai_summary:
+                    self._summary_cache.set(cache_key, ai_summary)
+                else:
+                    # agenerate_text returns "" on provider errors; don't render an empty quote
+                    ai_summary = "Review completed."
+            except Exception:
+                ai_summary = "Review completed."
 
-        Output (sample):
-        - "🛡️"
-        """
-        return {"Security": "🛡️", "Quality": "🧠", "Architect": "🏗️"}.get(type_, "📝")
+        return f"## 🤖 Lyzr Review Report\n\n**Total Issues:** {count} | **Critical Issues:** {critical_count}\n\n> {ai_summary}\n"
 
-    def _get_severity_icon(self, severity: str) -> str:
+    async def _arun_single_prompt(self, instruction: str) -> str:
         """
-        Map severity label to a visual icon used in report tables/details.
+        Send one instruction straight to the model with the writer persona as system message.
 
         Input (sample):
-        - severity: "High"
+        - instruction: "You are a CTO summarizing a code review. ..."
 
         Output (sample):
-        - "🟠"
+        - "The PR introduces a critical injection risk in the login flow."
         """
-        return {"Critical": "🔴", "High": "🟠", "Medium": "🟡", "Low": "🔵"}.get(severity, "⚪")
+        return await self.llm_model.agenerate_text(
+            task_id="Summary",
+            system_persona=self.agent.prompt_persona,
+            prompt=instruction,
+        )
@@ -0,0 +1,157 @@
+"""
+In-process caching helpers for LLM results and webhook deduplication.
+"""
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+import orjson
+
+from src.config import settings
+
+
+def content_hash(*parts: Any) -> str:
+    """
+    Build a stable cache key from the pieces that determine an LLM answer.
+
+    Input (sample):
+    - parts: ("gemini/gemini-2.5-flash-lite", "v1", "src/db.py", 120, "+ query = ...")
+
+    Output (sample):
+    - "9f86d081884c7d659a2feaa0c55ad015" (128-bit blake2b hex digest)
+    """
+    return hashlib.blake2b("|".join(str(p) for p in parts).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class SQLiteCache:
+    def __init__(self, path: str, namespace: str):
+        """
+        Open a JSON key/value table in a SQLite file so cached results survive restarts.
+
+        Input (sample):
+        - path: "/var/lib/pr-agent/llm_cache.sqlite3"
+        - namespace: "quality"
+
+        Output (sample):
+        - SQLiteCache bound to rows of that namespace.
+        """
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Return the stored value for a key.
+
+        Input (sample):
+        - key: "9f86d081884c7d65..."
+
+        Output (sample):
+        - [{"file": "src/db.py", "line": 125, ...}] on hit, None on miss
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM llm_cache WHERE namespace = ? AND key = ?", (self.namespace, key)
+            ).fetchone()
+        return orjson.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Insert or replace the stored value for a key.
+
+        Input (sample):
+        - key: "9f86d081884c7d65..."
+        - value: [{"file": "src/db.py", "line": 125, ...}]
+
+        Output (sample):
+        - None
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (namespace, key, value) VALUES (?, ?, ?)",
+                (self.namespace, key, orjson.dumps(value))
+            )
+
+
+class LRUCache:
+    def __init__(self, maxsize: int = 1024, backing: Optional[SQLiteCache] = None):
+        """
+        Create a bounded mapping that evicts the least recently used entry.
+
+        Input (sample):
+        - maxsize: 1024
+        - backing: optional SQLiteCache consulted on misses and written through on set
+
+        Output (sample):
+        - Empty LRUCache instance.
+        """
+        self.maxsize = maxsize
+        self.backing = backing
+        self._data: OrderedDict[str, Any] = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Return the cached value and mark it as recently used.
+
+        Input (sample):
+        - key: "9f86d081884c7d65..."
+
+        Output (sample):
+        - [{"file": "src/db.py", "line": 125, ...}] on hit, None on miss
+        """
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            if self.backing is None:
+                return None
+            value = self.backing.get(key)
+            if value is not None:
+                self._remember(key, value)
+            return value
+        return self._data[key]
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Store a value, evicting the oldest entry once maxsize is exceeded.
+
+        Input (sample):
+        - key: "9f86d081884c7d65..."
+        - value: [{"file": "src/db.py", "line": 125, ...}]
+
+        Output (sample):
+        - None
+        """
+        self._remember(key, value)
+        if self.backing is not None:
+            self.backing.set(key, value)
+
+    def _remember(self, key: str, value: Any) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def result_cache(namespace: str) -> LRUCache:
+    """
+    Build an agent's LLM result cache, persisted to settings.LLM_CACHE_PATH when configured.
+
+    Input (sample):
+    - namespace: "security"
+
+    Output (sample):
+    - LRUCache(maxsize=settings.LLM_CACHE_SIZE), SQLite-backed if LLM_CACHE_PATH is set
+    """
+    backing = SQLiteCache(settings.LLM_CACHE_PATH, namespace) if settings.LLM_CACHE_PATH else None
+    return LRUCache(maxsize=settings.LLM_CACHE_SIZE, backing=backing)
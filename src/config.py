@@ -11,10 +11,21 @@ class Settings(BaseSettings):
 
     ENABLE_SECURITY_SCAN: bool = True
     ENABLE_QUALITY_SCAN: bool = True
+    # Estimated prompt tokens (len(content) // 4) packed into one batched agent call
+    BATCH_TOKEN_BUDGET: int = 6000
+    # Max hunks per batched call; each hunk adds its agent's per-hunk output allowance to max_tokens
+    BATCH_MAX_HUNKS: int = 16
+    # Max entries kept by each in-process LLM result cache
+    LLM_CACHE_SIZE: int = 1024
+    # SQLite file that persists LLM results across restarts; empty keeps the caches in memory only
+    LLM_CACHE_PATH: str = ""
+    # Max agent LLM calls in flight at once per review
+    LLM_MAX_CONCURRENCY: int = 32
     # Model Configuration (Gemini via LiteLLM)
     SECURITY_MODEL_NAME: str = "gemini/gemini-2.5-flash-lite"
     QUALITY_MODEL_NAME: str = "gemini/gemini-2.5-flash-lite"
     ARCHITECT_MODEL_NAME: str = "gemini/gemini-2.5-flash-lite"
+    # The report summary is one short sentence; flash-lite is already the small tier (capped at 60 tokens)
     SYNTHESIZER_MODEL_NAME: str = "gemini/gemini-2.5-flash-lite"
 
     class Config:
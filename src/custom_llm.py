@@ -1,9 +1,18 @@
 from lyzr_automata.ai_models.model_base import AIModel
-from litellm import completion
+from litellm import completion, acompletion
+import functools
+import inspect
 import logging
+import re
+from src.config import settings
 
 logger = logging.getLogger(__name__)
 
+# A streamed answer that opens with `[]` (optionally inside a ```json fence) carries no findings
+_EMPTY_LIST_PREFIX_RE = re.compile(r"^\s*(?:```(?:json)?\s*)?\[\s*\]")
+# Past this many characters the answer can no longer be a bare empty list
+_EMPTY_LIST_CHECK_WINDOW = 32
+
 class CustomLiteLLM(AIModel):
     def __init__(self, api_key, parameters):
         """
@@ -56,6 +65,63 @@ class CustomLiteLLM(AIModel):
             logger.error(f"LiteLLM generation failed for model {self.parameters.get('model')}: {e}")
             return ""
     
+    async def agenerate_text(self, task_id=None, system_persona=None, prompt=None, stop_on_empty_list=False, max_tokens=None):
+        """
+        Async variant of generate_text backed by litellm.acompletion.
+
+        Input (sample):
+        - task_id: "security-task-1"
+        - system_persona: "You are a Security Auditor"
+        - prompt: "Analyze this diff hunk..."
+        - stop_on_empty_list: True to stream and stop as soon as the answer opens with "[]"
+        - max_tokens: 8000 to override the configured output limit for this call (e.g. a batched prompt)
+
+        Output (sample):
+        - "[{\"file\": \"app.py\", \"line\": 12, ...}]"
+        - "[]" (early exit when stop_on_empty_list is set)
+        - "" (empty string on provider/runtime failure)
+        """
+        try:
+            model_name = self.parameters.get("model", "gemini/gemini-1.5-flash")
+            temperature = self.parameters.get("temperature", 0.2)
+            max_tokens = max_tokens or self.parameters.get("max_tokens", 2000)
+
+            messages = [
+                {"role": "system", "content": system_persona},
+                {"role": "user", "content": prompt},
+            ]
+
+            response = await acompletion(
+                model=model_name,
+                messages=messages,
+                api_key=self.api_key,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=stop_on_empty_list,
+            )
+
+            if not stop_on_empty_list:
+                return response["choices"][0]["message"]["content"]
+
+            buffer = ""
+            async for chunk in response:
+                buffer += chunk["choices"][0]["delta"]["content"] or ""
+                if len(buffer) <= _EMPTY_LIST_CHECK_WINDOW and _EMPTY_LIST_PREFIX_RE.match(buffer):
+                    # CustomStreamWrapper has no close(); closing its provider async generator
+                    # stops the rest of the answer being generated and releases the connection
+                    completion_stream = response.completion_stream
+                    if inspect.isasyncgen(completion_stream):
+                        try:
+                            await completion_stream.aclose()
+                        except Exception as e:
+                            logger.debug(f"Closing abandoned LLM stream failed: {e}")
+                    return "[]"
+            return buffer
+
+        except Exception as e:
+            logger.error(f"LiteLLM async generation failed for model {self.parameters.get('model')}: {e}")
+            return ""
+
     def generate_image(self, task_id=None, prompt=None):
         """
         Placeholder image generation method required by abstract base class.
@@ -67,4 +133,27 @@ class CustomLiteLLM(AIModel):
         Output (sample):
         - Raises NotImplementedError("Image generation not supported.")
         """
-        raise NotImplementedError("Image generation not supported.")
\ No newline at end of file
+        raise NotImplementedError("Image generation not supported.")
+
+
+@functools.lru_cache(maxsize=16)
+def get_litellm(model: str, temperature: float, max_tokens: int) -> CustomLiteLLM:
+    """
+    Return the shared CustomLiteLLM for one (model, temperature, max_tokens) combination.
+
+    Input (sample):
+    - model: "gemini/gemini-2.5-flash-lite"
+    - temperature: 0.1
+    - max_tokens: 2000
+
+    Output (sample):
+    - The same CustomLiteLLM instance for every agent asking for this configuration.
+    """
+    return CustomLiteLLM(
+        api_key=settings.GOOGLE_API_KEY,
+        parameters={
+            "model": model,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        },
+    )
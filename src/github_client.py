@@ -1,30 +1,84 @@
+import asyncio
 import logging
-import requests
-from github import Github, GithubException
+import httpx
 from src.config import settings
 
 logger = logging.getLogger(__name__)
 
+GITHUB_API_URL = "https://api.github.com"
+# Transient GitHub statuses worth retrying; a 403 is retried only when it is a rate limit
+RETRY_STATUSES = (429, 502, 503)
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF = 0.5
+DIFF_HEADERS = {
+    "Accept": "application/vnd.github.v3.diff",
+    "Accept-Encoding": "gzip"
+}
+
+def _is_retryable(response: httpx.Response) -> bool:
+    """
+    Decide whether a GitHub response is a transient failure worth retrying.
+
+    Input (sample):
+    - response: httpx.Response(403, headers={"X-RateLimit-Remaining": "0"})
+
+    Output (sample):
+    - True (403 only when it is a primary or secondary rate limit, not a permission error)
+    """
+    if response.status_code == 403:
+        return response.headers.get("X-RateLimit-Remaining") == "0" or "Retry-After" in response.headers
+    return response.status_code in RETRY_STATUSES
+
 class GitHubClient:
     def __init__(self):
         """
-        Initialize authenticated PyGithub client from application settings.
+        Initialize the GitHub REST client from application settings.
 
         Input (sample):
         - None (reads settings.GITHUB_TOKEN)
 
         Output (sample):
-        - self.client: Github("<token>") when configured, else None.
+        - self.token: "<token>" when configured, else None.
+        - self._async_client: pooled httpx.AsyncClient for diff downloads and comments, created on first use.
         """
-        if not settings.GITHUB_TOKEN:
+        self.token = settings.GITHUB_TOKEN or None
+        if not self.token:
             logger.warning("GITHUB_TOKEN not set. GitHub operations will fail.")
-            self.client = None
-        else:
-            self.client = Github(settings.GITHUB_TOKEN)
 
-    def get_pr_diff(self, repo_name: str, pr_number: int) -> str:
+        # An AsyncClient's pool belongs to the event loop it was first used on
+        self._async_client = None
+        self._async_loop = None
+
+    async def _async_http(self) -> httpx.AsyncClient:
+        """
+        Return the pooled async HTTP client for the running event loop, closing one left from a previous loop.
+
+        Input (sample):
+        - None
+
+        Output (sample):
+        - httpx.AsyncClient with the token header and a keep-alive pool
+        """
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            if self._async_client is not None:
+                try:
+                    await self._async_client.aclose()
+                except Exception as e:
+                    # Connections bound to a closed loop cannot be shut down cleanly; drop them
+                    logger.debug(f"Closing previous GitHub HTTP client failed: {e}")
+            self._async_client = httpx.AsyncClient(
+                headers={"Authorization": f"token {self.token}"},
+                timeout=10,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+                transport=httpx.AsyncHTTPTransport(retries=RETRY_ATTEMPTS),
+            )
+            self._async_loop = loop
+        return self._async_client
+
+    async def aget_pr_diff(self, repo_name: str, pr_number: int) -> str:
         """
-        Fetch raw unified diff text for a specific pull request.
+        Fetch raw unified diff text for a pull request without blocking the event loop.
 
         Input (sample):
         - repo_name: "org/repo"
@@ -33,33 +87,32 @@ class GitHubClient:
         Output (sample):
         - "diff --git a/src/a.py b/src/a.py\n@@ -1 +1 @@\n-old\n+new"
         """
-        if not self.client:
+        if not self.token:
             raise ValueError("GitHub Client not initialized")
 
+        diff_url = f"{GITHUB_API_URL}/repos/{repo_name}/pulls/{pr_number}"
+
         try:
-            logger.info(f"Fetching PR object: {repo_name} #{pr_number}")
-            repo = self.client.get_repo(repo_name)
-            pr = repo.get_pull(pr_number)
-            
-            # Fetch the raw diff content using the requests library
-            headers = {
-                "Authorization": f"token {settings.GITHUB_TOKEN}",
-                "Accept": "application/vnd.github.v3.diff"
-            }
-            
-            logger.debug(f"Downloading raw diff from: {pr.diff_url}")
-            response = requests.get(pr.diff_url, headers=headers, timeout=10)
+            logger.info(f"Downloading raw diff (async) from: {diff_url}")
+            client = await self._async_http()
+
+            # Back off and retry on transient statuses
+            for attempt in range(RETRY_ATTEMPTS + 1):
+                response = await client.get(diff_url, headers=DIFF_HEADERS)
+                if not _is_retryable(response) or attempt == RETRY_ATTEMPTS:
+                    break
+                await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+
             response.raise_for_status()
-            
-            return response.text
+            return response.content.decode("utf-8", errors="replace")
 
         except Exception as e:
             logger.error(f"Failed to fetch diff for {repo_name} #{pr_number}: {e}")
             raise
 
-    def post_comment(self, repo_name: str, pr_number: int, body: str):
+    async def apost_comment(self, repo_name: str, pr_number: int, body: str) -> bool:
         """
-        Post a plain timeline comment on a pull request.
+        Post a plain timeline comment on a pull request via the issues comments endpoint.
 
         Input (sample):
         - repo_name: "org/repo"
@@ -67,20 +120,25 @@ class GitHubClient:
         - body: "## Lyzr Review Report\n..."
 
         Output (sample):
-        - None (side effect: comment created in GitHub PR timeline)
+        - True once the comment is created in the GitHub PR timeline, False on failure
         """
-        if not self.client:
+        if not self.token:
             logger.error("Cannot post comment: GitHub Client not initialized")
-            return
+            return False
 
         try:
-            repo = self.client.get_repo(repo_name)
-            pr = repo.get_pull(pr_number)
-            
-            pr.create_issue_comment(body)
+            client = await self._async_http()
+            response = await client.post(
+                f"{GITHUB_API_URL}/repos/{repo_name}/issues/{pr_number}/comments",
+                headers={"Accept": "application/vnd.github+json"},
+                json={"body": body},
+            )
+            response.raise_for_status()
             logger.info(f"Successfully posted comment to {repo_name} #{pr_number}")
+            return True
 
-        except GithubException as e:
-            logger.error(f"GitHub API Error posting comment: {e.status} - {e.data}")
+        except httpx.HTTPStatusError as e:
+            logger.error(f"GitHub API Error posting comment: {e.response.status_code} - {e.response.text}")
         except Exception as e:
-            logger.error(f"Unexpected error posting comment: {e}")
\ No newline at end of file
+            logger.error(f"Unexpected error posting comment: {e}")
+        return False
@@ -1,11 +1,13 @@
 import logging
+import orjson
 from fastapi import FastAPI, BackgroundTasks, HTTPException, Request, status
 import uvicorn
 
 from src.config import settings
-from src.models import RawDiffRequest, PRWebhookPayload, AnalysisReport
+from src.models import RawDiffRequest, AnalysisReport
 from src.orchestrator import ReviewOrchestrator
 from src.utils import verify_webhook_signature
+from src.cache import LRUCache
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,7 +18,45 @@ app = FastAPI(
 )
 
 orchestrator = ReviewOrchestrator()
-PROCESSED_COMMITS = set()
+# Bounded so webhook dedup state cannot grow without limit under sustained traffic
+PROCESSED_COMMITS = LRUCache(maxsize=10_000)
+# Commits whose review is queued or running; claimed before queueing so bursts enqueue once
+IN_FLIGHT_COMMITS = set()
+
+
+def _claim_commit(unique_key: str) -> bool:
+    """
+    Atomically claim a commit for review; False when it is already queued, running or done.
+    There is no await between the check and the add, so concurrent webhooks cannot both win.
+
+    Input (sample):
+    - unique_key: "org/repo/42/abc123..."
+
+    Output (sample):
+    - True for the first event of a commit, False for every duplicate
+    """
+    if unique_key in IN_FLIGHT_COMMITS or PROCESSED_COMMITS.get(unique_key) is not None:
+        return False
+    IN_FLIGHT_COMMITS.add(unique_key)
+    return True
+
+
+async def _run_claimed_review(unique_key: str, repo_full_name: str, pr_number: int):
+    """
+    Run one claimed PR review; only a successful one moves the claim into the processed store.
+
+    Input (sample):
+    - unique_key: "org/repo/42/abc123...", repo_full_name: "org/repo", pr_number: 42
+
+    Output (sample):
+    - None (claim always released, so a failed review is retried by the next delivery)
+    """
+    try:
+        if await orchestrator.process_pr(repo_full_name, pr_number):
+            PROCESSED_COMMITS.set(unique_key, True)
+    finally:
+        IN_FLIGHT_COMMITS.discard(unique_key)
+
 
 @app.get("/health", status_code=status.HTTP_200_OK)
 def health_check():
@@ -106,26 +146,31 @@ async def github_webhook(
         return {"status": "ignored", "reason": "Event not supported"}
     
     # 1. Verify Signature
-    payload_body = await request.body()
     signature_header = request.headers.get("X-Hub-Signature-256", "")
+    # A missing or malformed header can never verify; reject before reading the body
+    if settings.WEBHOOK_SECRET and not signature_header.startswith("sha256="):
+        return {"status": "error", "message": "Invalid signature"}
+
+    payload_body = await request.body()
     if settings.WEBHOOK_SECRET and not verify_webhook_signature(payload_body, signature_header):
         return {"status": "error", "message": "Invalid signature"}
     
-    # 2. Parse Payload
+    # 2. Parse Payload (only four fields are needed, so skip full model validation of the large body)
     try:
-        payload = PRWebhookPayload.model_validate_json(payload_body)
+        payload = orjson.loads(payload_body)
+        action = payload["action"]
+        pr_number = int(payload["number"])
+        repo_full_name = payload["repository"].get("full_name")
+        head_sha = payload["pull_request"].get("head", {}).get("sha", "")
     except Exception as e:
         logger.error(f"Payload parsing failed: {e}")
         return {"status": "error", "message": "Invalid payload"}
 
     # 3. Filter Actions
-    if payload.action not in ["opened", "synchronize"]:
-        return {"status": "ignored", "reason": f"Action '{payload.action}' not supported"}
+    if action not in ["opened", "synchronize"]:
+        return {"status": "ignored", "reason": f"Action '{action}' not supported"}
 
     # 4. Deduplication
-    repo_full_name = payload.repository.get("full_name")
-    pr_number = payload.number
-    head_sha = payload.pull_request.get("head", {}).get("sha", "")
     
     if not head_sha:
         logger.warning("No head SHA found in payload")
@@ -133,15 +178,13 @@ async def github_webhook(
 
     unique_key = f"{repo_full_name}/{pr_number}/{head_sha}"
 
-    if unique_key in PROCESSED_COMMITS:
-        logger.info(f"🛑 Skipping duplicate event for {unique_key} (Already processed)")
+    if not _claim_commit(unique_key):
+        logger.info(f"🛑 Skipping duplicate event for {unique_key} (Already queued or processed)")
         return {"status": "ignored", "reason": "Duplicate event"}
-    
-    PROCESSED_COMMITS.add(unique_key)
 
     # 5. Background Task
     logger.info(f"Queueing review for {repo_full_name} #{pr_number} (SHA: {head_sha[:7]})")
-    background_tasks.add_task(orchestrator.process_pr, repo_full_name, pr_number)
+    background_tasks.add_task(_run_claimed_review, unique_key, repo_full_name, pr_number)
     
     return {"status": "accepted"}
 
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Literal, Optional, Any, Dict
+from typing import List, Literal, Optional
 
 # INPUT MODELS
 
@@ -10,19 +10,6 @@ class RawDiffRequest(BaseModel):
     diff_text: str 
 
 
-class PRWebhookPayload(BaseModel):
-    """
-    Schema for the GitHub Webhook payload.
-    """
-    action: str
-    number: int
-    repository: Dict[str, Any]
-    pull_request: Dict[str, Any]
-
-    class Config:
-        extra = "ignore"  # ignore extra GitHub fields
-
-
 # OUTPUT MODELS
 
 class ReviewComment(BaseModel):
@@ -1,10 +1,12 @@
+import asyncio
 import logging
 import re
 from typing import List, Dict
 
+from src.config import settings
 from src.github_client import GitHubClient
 from src.models import AnalysisReport, ReviewComment
-from src.utils import parse_diff_hunks, is_binary_file
+from src.utils import parse_diff_hunk_lines, is_binary_file, batch_hunks_by_token_budget
 from src.agents.security_agent import SecurityAgent
 from src.agents.quality_agent import QualityAgent
 from src.agents.architect_agent import ArchitectAgent
@@ -12,8 +14,35 @@ from src.agents.synthesizer import SynthesizerAgent
 
 logger = logging.getLogger(__name__)
 
-IGNORED_EXTENSIONS = {'.lock', '.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', '.woff', '.woff2', '.ttf', '.eot'}
-IGNORED_FILES = {'yarn.lock', 'package-lock.json', 'poetry.lock', 'Pipfile.lock', 'composer.lock'}
+IGNORED_EXTENSIONS = frozenset({'.lock', '.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', '.woff', '.woff2', '.ttf', '.eot'})
+IGNORED_FILES = frozenset({'yarn.lock', 'package-lock.json', 'poetry.lock', 'Pipfile.lock', 'composer.lock'})
+
+# Line-comment prefixes per extension; changes made only of these lines are skipped.
+# A bare '*' is deliberately absent: in C-family code it also starts dereferences like `*p = v;`.
+COMMENT_PREFIXES = {
+    '.py': ('#',),
+    '.rb': ('#',),
+    '.sh': ('#',),
+    '.yml': ('#',),
+    '.yaml': ('#',),
+    '.js': ('//', '/*'),
+    '.jsx': ('//', '/*'),
+    '.ts': ('//', '/*'),
+    '.tsx': ('//', '/*'),
+    '.java': ('//', '/*'),
+    '.go': ('//', '/*'),
+    '.c': ('//', '/*'),
+    '.h': ('//', '/*'),
+    '.cpp': ('//', '/*'),
+    '.cs': ('//', '/*'),
+    '.rs': ('//', '/*'),
+    '.sql': ('--',),
+}
+
+# File-header patterns for _parse_chunk, compiled once at import
+_DIFF_HEADER_RE = re.compile(r'diff --git a/.*? b/(.*)')
+_DIFF_A_RE = re.compile(r'diff --git a/(.*?) b/')
+_DIFF_FALLBACK_RE = re.compile(r'diff --git.*?([ab])/(.+?)(?:\s|$)')
 
 
 class ReviewOrchestrator:
@@ -40,6 +69,18 @@ class ReviewOrchestrator:
         Input (sample):
         - diff_text: "diff --git a/a.py b/a.py\n@@ -1 +1 @@\n-x\n+y"
 
+        Output (sample):
+        - AnalysisReport(summary="## ...", comments=[ReviewComment(...), ...])
+        """
+        return asyncio.run(self.aprocess_diff_text(diff_text))
+
+    async def aprocess_diff_text(self, diff_text: str) -> AnalysisReport:
+        """
+        Async review flow: every agent reviews token-bounded hunk batches, all dispatched concurrently.
+
+        Input (sample):
+        - diff_text: "diff --git a/a.py b/a.py\n@@ -1 +1 @@\n-x\n+y"
+
         Output (sample):
         - AnalysisReport(summary="## ...", comments=[ReviewComment(...), ...])
         """
@@ -55,7 +96,8 @@ class ReviewOrchestrator:
         
         all_comments: List[ReviewComment] = []
 
-        # 2. Agent analysis loop
+        # 2. Flatten every file's hunks into one job list
+        hunk_jobs = []
         for chunk in chunks:
             filename = chunk['filename']
             hunks = chunk.get('hunks', [])
@@ -64,56 +106,67 @@ class ReviewOrchestrator:
                 logger.info(f"No hunks found in {filename}, skipping")
                 continue
 
-            logger.info(f"Analyzing file: {filename}")
-
             for hunk in hunks:
-                hunk_content = hunk['content']
-                start_line = hunk['start_line']
-
-                cleaned_hunk_content = "\n".join(
-                    line for line in hunk_content.split("\n") if not line.startswith("@@")
-                )
+                cleaned_hunk_content = hunk['body']
+
+                # The prompts tell every agent to ignore whitespace/comment churn; don't pay a call for it
+                if not self._has_semantic_change(cleaned_hunk_content, filename):
+                    logger.info(f"Skipping whitespace/comment-only hunk in {filename} at line {hunk['start_line']}")
+                    continue
+                hunk_jobs.append({
+                    'filename': filename,
+                    'content': cleaned_hunk_content,
+                    'start_line': hunk['start_line']
+                })
+
+        # 3. Dispatch every agent call at once; all agents share the same token-bounded hunk batches
+        batches = batch_hunks_by_token_budget(hunk_jobs, settings.BATCH_TOKEN_BUDGET, settings.BATCH_MAX_HUNKS)
+        calls = [
+            *[self.security.aanalyze_batch(batch) for batch in batches],
+            *[self.quality.aanalyze_batch(batch) for batch in batches],
+            *[self.architect.aanalyze_batch(batch) for batch in batches],
+        ]
+        # Bound the fan-out so a large PR doesn't open hundreds of provider requests at once
+        semaphore = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+        results = await asyncio.gather(
+            *[self._bounded(semaphore, call) for call in calls],
+            return_exceptions=True
+        )
+
+        # 4. Collect findings; a failed call only loses its own batch
+        agent_names = ("Security", "Quality", "Architect")
+        for i, result in enumerate(results):
+            agent_name, batch = agent_names[i // len(batches)], batches[i % len(batches)]
+            if isinstance(result, BaseException):
+                logger.error(f"{agent_name} agent failed on batch of {len(batch)} hunks: {result}")
+                continue
+            for hunk_comments in result.values():
+                all_comments.extend(hunk_comments)
 
-                try:
-                    sec_comments = self.security.analyze(
-                        content=cleaned_hunk_content,
-                        filename=filename,
-                        start_line=start_line
-                    )
-                    all_comments.extend(sec_comments)
-                except Exception as e:
-                    logger.error(f"Security agent failed on {filename}: {e}")
-
-                try:
-                    qual_comments = self.quality.analyze(
-                        content=cleaned_hunk_content,
-                        filename=filename,
-                        start_line=start_line
-                    )
-                    all_comments.extend(qual_comments)
-                except Exception as e:
-                    logger.error(f"Quality agent failed on {filename}: {e}")
-
-                try:
-                    arch_comments = self.architect.analyze(
-                        content=cleaned_hunk_content,
-                        filename=filename,
-                        start_line=start_line
-                    )
-                    all_comments.extend(arch_comments)
-                except Exception as e:
-                    logger.error(f"Architect agent failed on {filename}: {e}")
-
-        # 3. Synthesis
+        # 5. Synthesis
         try:
-            summary = self.synthesizer.create_report(all_comments)
+            summary = await self.synthesizer.acreate_report(all_comments)
         except Exception as e:
             logger.error(f"Synthesizer failed: {e}")
             summary = f"Analysis completed with {len(all_comments)} findings."
         
         return AnalysisReport(summary=summary, comments=all_comments)
 
-    def process_pr(self, repo_name: str, pr_number: int):
+    async def _bounded(self, semaphore: asyncio.Semaphore, call):
+        """
+        Await one agent call while holding a slot of the shared concurrency limit.
+
+        Input (sample):
+        - semaphore: asyncio.Semaphore(32)
+        - call: self.quality.aanalyze_batch([{"filename": "a.py", "content": "...", "start_line": 1}])
+
+        Output (sample):
+        - Whatever the call returns, e.g. {"0": [ReviewComment(...)]}
+        """
+        async with semaphore:
+            return await call
+
+    async def process_pr(self, repo_name: str, pr_number: int) -> bool:
         """
         Fetch PR diff from GitHub, analyze it, and post summary comment back to PR.
 
@@ -122,36 +175,67 @@ class ReviewOrchestrator:
         - pr_number: 42
 
         Output (sample):
-        - None (side effects: GitHub API call to create issue comment)
+        - True once the review is posted (or the PR has no diff), False when any step failed
+        - Side effects: GitHub API call to create issue comment
         """
         try:
             logger.info(f"Processing PR #{pr_number} in {repo_name}")
             
             # Step 1: Fetch Data
-            diff_text = self.gh_client.get_pr_diff(repo_name, pr_number)
+            # Non-blocking download, so queued PRs share the loop instead of worker threads
+            diff_text = await self.gh_client.aget_pr_diff(repo_name, pr_number)
             
             if not diff_text:
                 logger.warning(f"No diff content for PR #{pr_number}")
-                return
+                return True
 
             # Step 2: Analyze
-            report = self.process_diff_text(diff_text)
+            report = await self.aprocess_diff_text(diff_text)
 
             # Step 3: Post Results
-            self.gh_client.post_comment(repo_name, pr_number, report.summary)
+            if not await self.gh_client.apost_comment(repo_name, pr_number, report.summary):
+                return False
             
             logger.info(f"Successfully posted review for PR #{pr_number}")
+            return True
             
         except Exception as e:
             logger.error(f"Orchestration failed for {repo_name} #{pr_number}: {e}")
             try:
-                self.gh_client.post_comment(
-                    repo_name, 
+                await self.gh_client.apost_comment(
+                    repo_name,
                     pr_number, 
                     "⚠️ PR Review Agent encountered an error during analysis. Please check logs."
                 )
             except Exception:
                 logger.error("Failed to post error comment to PR")
+            return False
+
+    def _has_semantic_change(self, body: str, filename: str) -> bool:
+        """
+        Check whether a hunk changes anything beyond blank lines and line comments.
+
+        Input (sample):
+        - body: "-# old note\n+# new note\n    x = 1\n"
+        - filename: "src/a.py"
+
+        Output (sample):
+        - False (only comment lines were added/removed)
+        """
+        ext = filename[filename.rfind('.'):].lower() if '.' in filename else ''
+        comment_prefixes = COMMENT_PREFIXES.get(ext, ())
+
+        for line in body.split("\n"):
+            marker = line[:1]
+            if marker not in ('+', '-'):
+                continue
+            code = line[1:].strip()
+            if code and not (comment_prefixes and code.startswith(comment_prefixes)):
+                return True
+            # "/* c */ code();" closes the block comment and carries on with code
+            if code.startswith('/*') and '*/' in code and code[code.index('*/') + 2:].strip():
+                return True
+        return False
 
     def _split_diff_into_chunks(self, diff_text: str) -> List[Dict[str, str]]:
         """
@@ -169,20 +253,18 @@ class ReviewOrchestrator:
         chunks = []
         if not diff_text: return chunks
 
-        # 1. Split by git header and merge delimiter back into each chunk
-        raw_chunks = re.split(r'(diff --git)', diff_text)
-        current_chunk = ""
-        
-        for part in raw_chunks:
-            if part == 'diff --git':
-                if current_chunk:
-                    chunks.append(self._parse_chunk(current_chunk))
-                current_chunk = part
-            else:
-                current_chunk += part
-        
-        if current_chunk:
-            chunks.append(self._parse_chunk(current_chunk))
+        # 1. Split on file headers at line starts; a plain literal split needs no regex or re-stitching loop
+        parts = diff_text.split("\ndiff --git ")
+        last = len(parts) - 1
+
+        for i, part in enumerate(parts):
+            # Restore the header prefix and the newline the separator consumed
+            chunk_text = part if i == 0 else "diff --git " + part
+            if i < last:
+                chunk_text += "\n"
+            # A preamble before the first header resolves to "unknown" and is filtered below
+            if chunk_text:
+                chunks.append(self._parse_chunk(chunk_text))
 
         # 2. Filter out unresolvable and ignored entries
         return [c for c in chunks if c['filename'] not in ["unknown", "ignored"]]
@@ -198,44 +280,46 @@ class ReviewOrchestrator:
         - {
                 "filename": "src/a.py",
                 "content": "...",
-                "hunks": [{"start_line": 1, "content": "...", ...}],
+                "hunks": [{"start_line": 1, "body": "...", ...}],
                 "metadata": {"is_rename": false, "is_new_file": false, "is_deleted": false}
             }
         """
-        # 1. Extract header info
-        lines = chunk_text.split('\n')
-        first_line = lines[0] if lines else ""
-        is_rename = any('rename from' in line or 'rename to' in line for line in lines[:10])
-        is_binary = 'Binary files' in chunk_text or is_binary_file(first_line)
-
-        # 2. Resolve filename from diff header
-        match = re.search(r'diff --git a/.*? b/(.*)', first_line)
+        # 1. Resolve filename from the diff header line alone
+        first_line = chunk_text.partition('\n')[0]
+        match = _DIFF_HEADER_RE.search(first_line)
         if match:
             filename = match.group(1)
             if filename == 'dev/null':
-                a_match = re.search(r'diff --git a/(.*?) b/', first_line)
+                a_match = _DIFF_A_RE.search(first_line)
                 filename = a_match.group(1) if a_match else "deleted_file"
         else:
-            fallback_match = re.search(r'diff --git.*?([ab])/(.+?)(?:\s|$)', first_line)
+            fallback_match = _DIFF_FALLBACK_RE.search(first_line)
             if fallback_match:
                 filename = fallback_match.group(2)
             else:
                 filename = "unknown"
 
-        # 3. Skip ignored, extension-blocked, and binary files
+        # 2. Skip ignored and extension-blocked files before anything scans the (possibly huge) body
         if filename in IGNORED_FILES:
             return {'filename': 'ignored', 'content': '', 'hunks': []}
         
-        ext = '.' + filename.split('.')[-1] if '.' in filename else ''
-        if ext.lower() in IGNORED_EXTENSIONS:
+        ext = filename[filename.rfind('.'):].lower() if '.' in filename else ''
+        if ext in IGNORED_EXTENSIONS:
             return {'filename': 'ignored', 'content': '', 'hunks': []}
-        
+
+        # 3. Git writes rename and binary markers in the extended header, before the first hunk
+        hunk_start = chunk_text.find('\n@@')
+        header = chunk_text if hunk_start == -1 else chunk_text[:hunk_start]
+        is_binary = 'Binary files' in header or is_binary_file(first_line)
         if is_binary:
             logger.debug(f"Skipping binary file: {filename}")
             return {'filename': 'ignored', 'content': '', 'hunks': []}
 
-        # 4. Parse hunks and build result
-        hunks = parse_diff_hunks(chunk_text)
+        # Git always emits "rename from" and "rename to" together, so one marker is enough
+        is_rename = 'rename from ' in header
+
+        # 4. Only the hunk parser needs the chunk as lines
+        hunks = parse_diff_hunk_lines(chunk_text.split('\n'))
         
         metadata = {
             'is_rename': is_rename,
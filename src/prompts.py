@@ -10,6 +10,9 @@ You are analyzing a **PARTIAL GIT DIFF HUNK**.
 """
 
 # --- SECURITY AGENT ---
+# Bump whenever the security prompt changes so cached findings are invalidated
+SECURITY_PROMPT_VERSION = "v1"
+
 SECURITY_PERSONA = """
 You are a Lead Application Security Engineer. 
 You are CYNICAL. You assume all input is malicious.
@@ -28,6 +31,9 @@ If code is safe, return `[]`.
 """
 
 # --- QUALITY AGENT ---
+# Bump whenever the quality prompt changes so cached findings are invalidated
+QUALITY_PROMPT_VERSION = "v1"
+
 QUALITY_PERSONA = """
 You are a Senior Python Developer focused on RELIABILITY.
 You DO NOT care about Security (another agent handles that).
@@ -51,6 +57,9 @@ If logic is sound, return `[]`.
 """
 
 # --- ARCHITECT AGENT ---
+# Bump whenever the architect prompt changes so cached findings are invalidated
+ARCHITECT_PROMPT_VERSION = "v1"
+
 ARCHITECT_PERSONA = """
 You are a Principal Software Architect.
 You care about SYSTEM HEALTH, not line-level bugs.
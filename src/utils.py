@@ -2,34 +2,52 @@
 Shared utility functions for PR Agent.
 """
 import re
-import json
+import functools
 import logging
-import hashlib
-from typing import Tuple, List
+from typing import Tuple, List, Optional, Set
 import hmac
+import orjson
+from pydantic import TypeAdapter
 from src.config import settings
+from src.models import ReviewComment
 
 
 logger = logging.getLogger(__name__)
 
+# Validates a whole list of findings in one pydantic-core call
+_COMMENTS_ADAPTER = TypeAdapter(List[ReviewComment])
 
-def clean_json_output(raw_text: str) -> str:
+# Patterns compiled once at import; the hunk-header ones run for every hunk of every PR
+# A leading preamble (optionally after an opening fence) or any markdown fence, stripped in one pass
+_FENCE_PREAMBLE_RE = re.compile(
+    r'^\s*(?:```(?:json)?\s*)?(?:Here is|Here\'s|The output is):?\s*|```(?:json)?\s*',
+    re.IGNORECASE,
+)
+_HUNK_HEADER_RE = re.compile(r'@@ -(\d+)(?:,\d+)? \+(\d+)(?:,\d+)? @@')
+_HUNK_HEADER_SINGLE_RE = re.compile(r'@@ -(\d+) \+(\d+) @@')
+
+# Settings are read once at startup, so the webhook key is encoded once too
+_WEBHOOK_SECRET_BYTES = settings.WEBHOOK_SECRET.encode("utf-8")
+
+
+def clean_and_validate(raw_text: str) -> Optional[str]:
     """
-    Normalize LLM output by removing markdown fences and common preamble text.
+    Strip markdown fences/preamble and confirm the result is bracketed like a JSON array or object.
 
     Input (sample):
     - raw_text: "```json\n[{\"file\":\"a.py\"}]\n```"
 
     Output (sample):
     - "[{\"file\":\"a.py\"}]"
+    - None for empty output or text that is not wrapped in [...] / {...}
     """
     if not raw_text:
-        return "[]"
-    
-    text = re.sub(r'```json\s*', '', raw_text)
-    text = re.sub(r'```\s*', '', text)
-    text = re.sub(r'^(Here is|Here\'s|The output is):?\s*', '', text, flags=re.IGNORECASE)
-    return text.strip()
+        return None
+
+    text = _FENCE_PREAMBLE_RE.sub('', raw_text).strip()
+    if text and text[0] in "[{" and text[-1] in "]}":
+        return text
+    return None
 
 
 def extract_line_numbers_from_hunk(hunk_header: str) -> Tuple[int, int]:
@@ -42,13 +60,13 @@ def extract_line_numbers_from_hunk(hunk_header: str) -> Tuple[int, int]:
     Output (sample):
     - (10, 12)
     """
-    match = re.search(r'@@ -(\d+)(?:,\d+)? \+(\d+)(?:,\d+)? @@', hunk_header)
+    match = _HUNK_HEADER_RE.search(hunk_header)
     if match:
         old_start = int(match.group(1))
         new_start = int(match.group(2))
         return (old_start, new_start)
     
-    fallback_match = re.search(r'@@ -(\d+) \+(\d+) @@', hunk_header)
+    fallback_match = _HUNK_HEADER_SINGLE_RE.search(hunk_header)
     if fallback_match:
         return (int(fallback_match.group(1)), int(fallback_match.group(2)))
     
@@ -63,45 +81,80 @@ def parse_diff_hunks(diff_content: str) -> List[dict]:
     - diff_content: "@@ -1 +1 @@\n-old\n+new"
 
     Output (sample):
-    - [{"start_line": 1, "content": "@@ -1 +1 @@\\n-old\\n+new\\n", "added_lines": [1], "removed_lines": [1]}]
+    - [{"start_line": 1, "body": "-old\\n+new\\n", "added_lines": [1], "removed_lines": [1]}]
+    """
+    return parse_diff_hunk_lines(diff_content.split('\n'))
+
+
+def parse_diff_hunk_lines(lines: List[str]) -> List[dict]:
+    """
+    Line-list form of parse_diff_hunks for callers that have already split the diff.
+
+    Input (sample):
+    - lines: ["@@ -1 +1 @@", "-old", "+new"]
+
+    Output (sample):
+    - [{"start_line": 1, "body": "-old\\n+new\\n", "added_lines": [1], "removed_lines": [1]}]
     """
     hunks = []
-    lines = diff_content.split('\n')
     
     current_hunk = None
+    current_lines = []
     current_new_line = 1
     
     for line in lines:
-        if line.startswith('@@'):
+        first = line[:1]
+        if first == '@' and line[:2] == '@@':
             if current_hunk:
+                # Join once per hunk; the trailing '' gives every body line its newline
+                current_lines.append('')
+                current_hunk['body'] = '\n'.join(current_lines)
                 hunks.append(current_hunk)
             
             old_start, new_start = extract_line_numbers_from_hunk(line)
             current_new_line = new_start
             
+            # Consumers only need the body, so the "@@" header itself is not kept
             current_hunk = {
                 'start_line': new_start,
-                'content': line + '\n',
+                'body': '',
                 'added_lines': [],
                 'removed_lines': []
             }
+            current_lines = []
         elif current_hunk:
-            current_hunk['content'] += line + '\n'
+            current_lines.append(line)
             
-            if line.startswith('+') and not line.startswith('+++'):
-                current_hunk['added_lines'].append(current_new_line)
+            # One first-character branch per line; "+++"/"---" lines still advance like context
+            if first == '+':
+                if not line.startswith('+++'):
+                    current_hunk['added_lines'].append(current_new_line)
                 current_new_line += 1
-            elif line.startswith('-') and not line.startswith('---'):
-                current_hunk['removed_lines'].append(current_new_line)
-            elif not line.startswith('\\'):
+            elif first == '-':
+                if line.startswith('---'):
+                    current_new_line += 1
+                else:
+                    current_hunk['removed_lines'].append(current_new_line)
+            elif first != '\\':
                 current_new_line += 1
     
     if current_hunk:
+        current_lines.append('')
+        current_hunk['body'] = '\n'.join(current_lines)
         hunks.append(current_hunk)
     
     return hunks
 
 
+BINARY_EXTENSIONS = frozenset({
+    '.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', 
+    '.woff', '.woff2', '.ttf', '.eot', '.otf',
+    '.pdf', '.zip', '.tar', '.gz', '.bz2',
+    '.exe', '.dll', '.so', '.dylib',
+    '.mp3', '.mp4', '.avi', '.mov'
+})
+
+
 def is_binary_file(filename: str) -> bool:
     """
     Detect whether a filename likely points to a binary/non-source asset.
@@ -112,52 +165,10 @@ def is_binary_file(filename: str) -> bool:
     Output (sample):
     - True
     """
-    binary_extensions = {
-        '.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', 
-        '.woff', '.woff2', '.ttf', '.eot', '.otf',
-        '.pdf', '.zip', '.tar', '.gz', '.bz2',
-        '.exe', '.dll', '.so', '.dylib',
-        '.mp3', '.mp4', '.avi', '.mov'
-    }
-    
-    ext = '.' + filename.split('.')[-1] if '.' in filename else ''
-    return ext.lower() in binary_extensions
-
-
-def validate_json_structure(json_str: str) -> bool:
-    """
-    Validate that JSON is a list of review-comment-like objects with required keys.
+    # Suffix after the last dot, found in one scan instead of splitting the whole name
+    ext = filename[filename.rfind('.'):].lower() if '.' in filename else ''
+    return ext in BINARY_EXTENSIONS
 
-    Input (sample):
-    - json_str: "[{\"file\":\"a.py\",\"line\":2,\"type\":\"Quality\",\"severity\":\"Low\",\"message\":\"...\"}]"
-
-    Output (sample):
-    - True
-    """
-    try:
-        data = json.loads(json_str)
-        
-        if not isinstance(data, list):
-            logger.warning("JSON output is not a list")
-            return False
-        
-        required_fields = {'file', 'line', 'type', 'severity', 'message'}
-        for item in data:
-            if not isinstance(item, dict):
-                logger.warning(f"List item is not a dict: {item}")
-                return False
-            
-            missing = required_fields - set(item.keys())
-            if missing:
-                logger.warning(f"Missing required fields: {missing}")
-                return False
-        
-        return True
-        
-    except json.JSONDecodeError as e:
-        logger.warning(f"JSON decode error: {e}")
-        return False
-    
 
 def verify_webhook_signature(payload_body: bytes, signature_header: str) -> bool:
     """
@@ -182,14 +193,12 @@ def verify_webhook_signature(payload_body: bytes, signature_header: str) -> bool
     
     expected_signature = signature_header[7:]
     
-    computed_hash = hmac.new(
-        settings.WEBHOOK_SECRET.encode("utf-8"),
-        payload_body,
-        hashlib.sha256
-    ).hexdigest()
+    # One-shot OpenSSL HMAC instead of building, updating and finalizing an hmac object
+    computed_hash = hmac.digest(_WEBHOOK_SECRET_BYTES, payload_body, "sha256").hex()
     
     return hmac.compare_digest(computed_hash, expected_signature)
 
+@functools.lru_cache(maxsize=1024)
 def is_test_file(filename: str) -> bool:
     """
     Detect whether a path looks like a test file for relaxed policy handling.
@@ -207,3 +216,186 @@ def is_test_file(filename: str) -> bool:
         fname.endswith("_test.py") or 
         fname.endswith("test.py")
     )
+
+
+def batch_hunks_by_token_budget(hunks: List[dict], token_budget: int, max_hunks: int) -> List[List[dict]]:
+    """
+    Pack hunk jobs into consecutive batches whose estimated prompt tokens stay under budget.
+
+    Input (sample):
+    - hunks: [{"filename": "a.py", "content": "...", "start_line": 10}, ...]
+    - token_budget: 6000 (estimated as len(content) // 4 per hunk)
+    - max_hunks: 16 (bounds the answer size, since the output limit scales with the hunk count)
+
+    Output (sample):
+    - [[hunk_0, hunk_1], [hunk_2]] (an oversized hunk gets a batch of its own)
+    """
+    batches = []
+    current_batch = []
+    current_tokens = 0
+
+    for hunk in hunks:
+        hunk_tokens = len(hunk['content']) // 4
+        if current_batch and (current_tokens + hunk_tokens > token_budget or len(current_batch) >= max_hunks):
+            batches.append(current_batch)
+            current_batch = []
+            current_tokens = 0
+        current_batch.append(hunk)
+        current_tokens += hunk_tokens
+
+    if current_batch:
+        batches.append(current_batch)
+
+    return batches
+
+
+def format_hunk_blocks(hunks: List[dict]) -> str:
+    """
+    Render hunk jobs as id-tagged blocks for a batched agent prompt.
+
+    Input (sample):
+    - hunks: [{"filename": "src/db.py", "content": "+ query = ...", "start_line": 120}]
+
+    Output (sample):
+    - "### HUNK id=0 file=src/db.py start_line=120\n+ query = ...\n"
+    """
+    return "\n".join(
+        f"### HUNK id={i} file={h['filename']} start_line={h['start_line']}\n{h['content']}\n"
+        for i, h in enumerate(hunks)
+    )
+
+
+def parse_batch_comments(raw_output: str, hunks: List[dict], agent_name: str) -> Tuple[dict, Set[str]]:
+    """
+    Demultiplex a batched LLM response into validated comments per hunk id.
+
+    Input (sample):
+    - raw_output: "[{\"hunk_id\": \"0\", \"comments\": [{...}]}]"
+    - hunks: the hunk list the prompt was built from
+    - agent_name: "Quality Agent" (used in log and error messages)
+
+    Output (sample):
+    - ({"0": [ReviewComment(...)]}, {"2"}) (comments per id, ids whose entry failed validation)
+    - Unknown ids and malformed entries are dropped; raises ValueError when the response is not a JSON list
+    """
+    cleaned_output = clean_and_validate(raw_output)
+    if cleaned_output is None:
+        raise ValueError(f"Invalid batched JSON structure from {agent_name}. Raw: {raw_output}")
+
+    try:
+        json_data = orjson.loads(cleaned_output)
+    except orjson.JSONDecodeError:
+        raise ValueError(f"Failed to parse batched JSON from {agent_name}. Raw: {raw_output}")
+
+    if not isinstance(json_data, list):
+        raise ValueError(f"Invalid batched JSON structure from {agent_name}. Raw: {raw_output}")
+
+    results = {}
+    failed = set()
+    for entry in json_data:
+        if not isinstance(entry, dict):
+            continue
+
+        hunk_id = str(entry.get("hunk_id", ""))
+        if not hunk_id.isdigit() or int(hunk_id) >= len(hunks):
+            logger.warning(f"{agent_name} returned unknown hunk_id: {hunk_id}")
+            continue
+
+        # The hunk id is authoritative for the file name
+        filename = hunks[int(hunk_id)]['filename']
+        try:
+            results.setdefault(hunk_id, []).extend(_COMMENTS_ADAPTER.validate_python(
+                [{**item, "file": filename} for item in entry.get("comments", [])]
+            ))
+        except Exception as e:
+            logger.error(f"Invalid comment in {agent_name} batch for {filename}: {e}")
+            failed.add(hunk_id)
+
+    return results, failed
+
+
+def split_cached_hunks(cache, hunks: List[dict], key_fn) -> Tuple[dict, List[Tuple[str, dict]]]:
+    """
+    Separate hunks with cached findings from hunks that still need a model call.
+
+    Input (sample):
+    - cache: agent LRUCache of comment dicts
+    - hunks: [{"filename": "src/db.py", "content": "...", "start_line": 120}, ...]
+    - key_fn: agent._cache_key(content, filename, start_line)
+
+    Output (sample):
+    - ({"0": [ReviewComment(...)]}, [("1", {"filename": "src/api.py", ...})])
+    """
+    results = {}
+    misses = []
+
+    for i, hunk in enumerate(hunks):
+        cached = cache.get(key_fn(hunk['content'], hunk['filename'], hunk['start_line']))
+        if cached is None:
+            misses.append((str(i), hunk))
+        else:
+            results[str(i)] = _COMMENTS_ADAPTER.validate_python(cached)
+
+    return results, misses
+
+
+def store_batch_results(cache, misses: List[Tuple[str, dict]], fresh: dict, failed: Set[str], key_fn) -> dict:
+    """
+    Cache freshly parsed batch findings and re-key them by the caller's hunk ids.
+    Hunks whose answer failed validation are returned but not cached, so the next run asks again.
+
+    Input (sample):
+    - misses: [("1", {"filename": "src/api.py", ...})]
+    - fresh: {"0": [ReviewComment(...)]} (keyed by position inside the batched prompt)
+    - failed: {"0"} (positions parse_batch_comments could not validate)
+
+    Output (sample):
+    - {"1": [ReviewComment(...)]}
+    """
+    results = {}
+
+    for position, (hunk_id, hunk) in enumerate(misses):
+        comments = fresh.get(str(position), [])
+        results[hunk_id] = comments
+        if str(position) in failed:
+            continue
+        cache.set(
+            key_fn(hunk['content'], hunk['filename'], hunk['start_line']),
+            [c.model_dump() for c in comments]
+        )
+
+    return results
+
+
+async def review_hunk_batch(hunks: List[dict], cache, key_fn, build_instruction, generate, agent_name: str) -> dict:
+    """
+    Shared batched-review loop: serve cached hunks, send the rest in one prompt, demux and cache the answer.
+
+    Input (sample):
+    - hunks: [{"filename": "src/db.py", "content": "...", "start_line": 120}, ...]
+    - cache / key_fn: the agent's result cache and agent._cache_key
+    - build_instruction: agent._build_batch_instruction(hunks) -> prompt
+    - generate: agent._arun_batch_prompt(instruction, hunk_count) -> raw model text
+    - agent_name: "Security Agent" (used in log and error messages)
+
+    Output (sample):
+    - {"0": [ReviewComment(...)], "1": []} keyed by position in hunks
+    - Only cached hunks when the call or the parse fails
+    """
+    results, misses = split_cached_hunks(cache, hunks, key_fn)
+    if not misses:
+        return results
+
+    logger.info(f"{agent_name} batch review on {len(misses)} hunks ({len(results)} cached)")
+
+    miss_hunks = [hunk for _, hunk in misses]
+    try:
+        raw_output = await generate(build_instruction(miss_hunks), len(miss_hunks))
+        fresh, failed = parse_batch_comments(raw_output, miss_hunks, agent_name)
+
+    except Exception as e:
+        logger.error(f"{agent_name} batch failed: {e}")
+        return results
+
+    results.update(store_batch_results(cache, misses, fresh, failed, key_fn))
+    return results
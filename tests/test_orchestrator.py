@@ -0,0 +1,37 @@
+import unittest
+
+from src.orchestrator import ReviewOrchestrator
+
+
+class HasSemanticChangeTest(unittest.TestCase):
+    def setUp(self):
+        # _has_semantic_change needs no agents or GitHub client
+        self.orchestrator = ReviewOrchestrator.__new__(ReviewOrchestrator)
+
+    def check(self, body: str, filename: str) -> bool:
+        return self.orchestrator._has_semantic_change(body, filename)
+
+    def test_pointer_dereference_is_code(self):
+        self.assertTrue(self.check("+*buf = user_input;\n", "copy.c"))
+        self.assertTrue(self.check("+    *counter += 1;\n", "lib.rs"))
+        self.assertTrue(self.check("+\t*p = v\n", "x.go"))
+
+    def test_increment_and_decrement_are_code(self):
+        self.assertTrue(self.check("+++i;\n", "loop.c"))
+        self.assertTrue(self.check("---n;\n", "loop.c"))
+
+    def test_comment_only_hunks_are_skipped(self):
+        self.assertFalse(self.check("-# old note\n+# new note\n    x = 1\n", "src/a.py"))
+        self.assertFalse(self.check("+// todo\n+/* note */\n", "main.go"))
+        self.assertFalse(self.check("+\n-   \n", "src/a.py"))
+
+    def test_code_after_closed_block_comment_is_code(self):
+        self.assertTrue(self.check("+/* c */ code();\n", "main.c"))
+        self.assertFalse(self.check("+/* c */  \n+/* open block\n", "main.c"))
+
+    def test_unknown_extension_keeps_comment_like_lines(self):
+        self.assertTrue(self.check("+# heading\n", "README.md"))
+
+
+if __name__ == "__main__":
+    unittest.main()
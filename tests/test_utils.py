@@ -0,0 +1,171 @@
+import asyncio
+import unittest
+
+from src.cache import LRUCache
+from src.utils import (
+    batch_hunks_by_token_budget, format_hunk_blocks, parse_batch_comments,
+    review_hunk_batch, store_batch_results
+)
+
+
+def _key(content: str, filename: str, start_line: int) -> str:
+    return f"{filename}:{start_line}:{content}"
+
+
+class BatchCachingTest(unittest.TestCase):
+    def setUp(self):
+        self.hunks = [
+            {"filename": "a.py", "content": "+x = 1\n", "start_line": 1},
+            {"filename": "b.py", "content": "+y = 2\n", "start_line": 5},
+        ]
+        self.misses = [(str(i), hunk) for i, hunk in enumerate(self.hunks)]
+
+    def test_invalid_entry_is_reported_and_not_cached(self):
+        raw = (
+            '[{"hunk_id": "0", "comments": [{"file": "a.py", "line": 1, "type": "Quality",'
+            ' "severity": "Info", "message": "m"}]}]'
+        )
+        fresh, failed = parse_batch_comments(raw, self.hunks, "Quality Agent")
+        self.assertEqual(failed, {"0"})
+
+        cache = LRUCache()
+        results = store_batch_results(cache, self.misses, fresh, failed, _key)
+
+        self.assertEqual(results, {"0": [], "1": []})
+        self.assertIsNone(cache.get(_key("+x = 1\n", "a.py", 1)))
+        self.assertEqual(cache.get(_key("+y = 2\n", "b.py", 5)), [])
+
+    def test_valid_entry_is_cached(self):
+        raw = (
+            '[{"hunk_id": "1", "comments": [{"file": "b.py", "line": 6, "type": "Quality",'
+            ' "severity": "Low", "message": "m"}]}]'
+        )
+        fresh, failed = parse_batch_comments(raw, self.hunks, "Quality Agent")
+        self.assertEqual(failed, set())
+
+        cache = LRUCache()
+        results = store_batch_results(cache, self.misses, fresh, failed, _key)
+
+        self.assertEqual(len(results["1"]), 1)
+        self.assertEqual(cache.get(_key("+y = 2\n", "b.py", 5))[0]["line"], 6)
+
+
+def _hunk(filename: str, content: str, start_line: int = 1) -> dict:
+    return {"filename": filename, "content": content, "start_line": start_line}
+
+
+class BatchHunksByTokenBudgetTest(unittest.TestCase):
+    def test_splits_when_budget_would_be_exceeded(self):
+        # 40 characters estimate to 10 tokens each
+        hunks = [_hunk(f"{i}.py", "x" * 40) for i in range(3)]
+        batches = batch_hunks_by_token_budget(hunks, token_budget=20, max_hunks=16)
+        self.assertEqual([len(b) for b in batches], [2, 1])
+        self.assertEqual([h for b in batches for h in b], hunks)
+
+    def test_splits_at_max_hunks(self):
+        hunks = [_hunk(f"{i}.py", "+x\n") for i in range(5)]
+        batches = batch_hunks_by_token_budget(hunks, token_budget=6000, max_hunks=2)
+        self.assertEqual([len(b) for b in batches], [2, 2, 1])
+
+    def test_oversized_hunk_gets_its_own_batch(self):
+        hunks = [_hunk("a.py", "x" * 8), _hunk("big.py", "x" * 400), _hunk("b.py", "x" * 8)]
+        batches = batch_hunks_by_token_budget(hunks, token_budget=20, max_hunks=16)
+        self.assertEqual([[h["filename"] for h in b] for b in batches], [["a.py"], ["big.py"], ["b.py"]])
+
+    def test_no_hunks_gives_no_batches(self):
+        self.assertEqual(batch_hunks_by_token_budget([], token_budget=20, max_hunks=16), [])
+
+
+class FormatHunkBlocksTest(unittest.TestCase):
+    def test_blocks_are_tagged_by_position(self):
+        text = format_hunk_blocks([_hunk("src/db.py", "+q = 1", 120), _hunk("src/api.py", "-r = 2", 7)])
+        self.assertEqual(
+            text,
+            "### HUNK id=0 file=src/db.py start_line=120\n+q = 1\n\n"
+            "### HUNK id=1 file=src/api.py start_line=7\n-r = 2\n",
+        )
+
+
+class ParseBatchCommentsTest(unittest.TestCase):
+    def setUp(self):
+        self.hunks = [_hunk("a.py", "+x = 1\n"), _hunk("b.py", "+y = 2\n", 5)]
+
+    def test_comments_are_demuxed_and_filed_by_hunk_id(self):
+        raw = (
+            '```json\n[{"hunk_id": "1", "comments": [{"file": "wrong.py", "line": 5, "type": "Security",'
+            ' "severity": "High", "message": "m"}]},'
+            ' {"hunk_id": 0, "comments": []},'
+            ' {"hunk_id": "7", "comments": [{"file": "a.py", "line": 1, "type": "Security",'
+            ' "severity": "Low", "message": "m"}]}]\n```'
+        )
+        fresh, failed = parse_batch_comments(raw, self.hunks, "Security Agent")
+
+        self.assertEqual(failed, set())
+        self.assertEqual(set(fresh), {"0", "1"})
+        self.assertEqual(fresh["0"], [])
+        self.assertEqual([c.file for c in fresh["1"]], ["b.py"])
+
+    def test_truncated_answer_raises(self):
+        raw = '[{"hunk_id": "0", "comments": [{"file": "a.py", "line": 1, "type": "Security"},'
+        with self.assertRaises(ValueError):
+            parse_batch_comments(raw, self.hunks, "Security Agent")
+
+    def test_cut_off_inside_brackets_raises(self):
+        raw = '[{"hunk_id": "0", "comments": [{"file": "a.py", "line": 1}]'
+        with self.assertRaises(ValueError):
+            parse_batch_comments(raw, self.hunks, "Security Agent")
+
+
+class ReviewHunkBatchTest(unittest.TestCase):
+    def setUp(self):
+        self.hunks = [_hunk("a.py", "+x = 1\n"), _hunk("b.py", "+y = 2\n", 5)]
+        self.calls = []
+
+    def _review(self, cache, raw_output):
+        async def generate(instruction, hunk_count):
+            self.calls.append((instruction, hunk_count))
+            return raw_output
+
+        return asyncio.run(review_hunk_batch(
+            self.hunks, cache, _key, format_hunk_blocks, generate, "Security Agent"
+        ))
+
+    def test_truncated_answer_returns_only_cached_hunks(self):
+        cache = LRUCache()
+        cache.set(_key("+x = 1\n", "a.py", 1), [])
+
+        results = self._review(cache, '[{"hunk_id": "0", "comments": [')
+
+        self.assertEqual(results, {"0": []})
+        self.assertEqual(self.calls, [("### HUNK id=0 file=b.py start_line=5\n+y = 2\n\n", 1)])
+        self.assertIsNone(cache.get(_key("+y = 2\n", "b.py", 5)))
+
+    def test_truncated_answer_with_nothing_cached_returns_nothing(self):
+        self.assertEqual(self._review(LRUCache(), '[{"hunk_id": "0"'), {})
+
+    def test_batch_positions_map_back_to_caller_ids(self):
+        cache = LRUCache()
+        cache.set(_key("+x = 1\n", "a.py", 1), [])
+        # The only miss is sent as id 0 but belongs to the caller's hunk 1
+        raw = (
+            '[{"hunk_id": "0", "comments": [{"file": "a.py", "line": 5, "type": "Security",'
+            ' "severity": "Medium", "message": "m"}]}]'
+        )
+
+        results = self._review(cache, raw)
+
+        self.assertEqual(results["0"], [])
+        self.assertEqual([(c.file, c.line) for c in results["1"]], [("b.py", 5)])
+        self.assertEqual(cache.get(_key("+y = 2\n", "b.py", 5))[0]["file"], "b.py")
+
+    def test_fully_cached_batch_skips_the_model(self):
+        cache = LRUCache()
+        for hunk in self.hunks:
+            cache.set(_key(hunk["content"], hunk["filename"], hunk["start_line"]), [])
+
+        self.assertEqual(self._review(cache, ""), {"0": [], "1": []})
+        self.assertEqual(self.calls, [])
+
+
+if __name__ == "__main__":
+    unittest.main()